@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Generate synthetic `;`-delimited inputs for csv_pivot benchmarks."""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import csv
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+
+
+MONTHS = ['{:02d}'.format(m) for m in range(1, 13)]
+
+# Columns the benchmark scenarios rely on; extra columns are filler.
+KEY_COLUMNS = ('region', 'month', 'product', 'customer', 'amount')
+
+
+def fieldnames(columns):
+    extra = max(columns - len(KEY_COLUMNS), 0)
+    return list(KEY_COLUMNS) + ['col{}'.format(i) for i in range(extra)]
+
+
+def generate_rows(rows, columns, cardinality, seed=0):
+    rng = random.Random(seed)
+    names = fieldnames(columns)
+    regions = ['region{}'.format(i) for i in range(max(cardinality // 100, 4))]
+    products = ['product{}'.format(i) for i in range(max(cardinality // 10, 8))]
+    customers = ['customer{}'.format(i) for i in range(cardinality)]
+    filler = ['x' * 8] * (len(names) - len(KEY_COLUMNS))
+    for _ in range(rows):
+        row = [
+            rng.choice(regions),
+            rng.choice(MONTHS),
+            rng.choice(products),
+            rng.choice(customers),
+            str(rng.randint(1, 1000)),
+        ]
+        row.extend(filler)
+        yield row
+
+
+def write_csv(filepath, rows, columns, cardinality, seed=0):
+    with open(filepath, 'w') as f:
+        writer = csv.writer(f, delimiter=';', lineterminator='\n')
+        writer.writerow(fieldnames(columns))
+        writer.writerows(generate_rows(rows, columns, cardinality, seed))
+    return filepath
+
+
+def _tar_mode(filepath):
+    if filepath.endswith('.gz'):
+        return 'w:gz'
+    if filepath.endswith('.bz2'):
+        return 'w:bz2'
+    return 'w'
+
+
+def write_tarball(filepath, rows, columns, cardinality, members=4, seed=0):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with tarfile.open(filepath, _tar_mode(filepath)) as archive:
+            for i in range(members):
+                member_rows = rows // members + (1 if i < rows % members else 0)
+                name = 'part{:03d}.csv'.format(i)
+                path = write_csv(os.path.join(tmpdir, name), member_rows,
+                    columns, cardinality, seed + i)
+                archive.add(path, arcname=name)
+    finally:
+        shutil.rmtree(tmpdir)
+    return filepath
+
+
+def main():
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('output', help='Path to generated file (.csv or .tar.gz).')
+    parser.add_argument('-r', '--rows', type=int, default=100000)
+    parser.add_argument('-c', '--columns', type=int, default=len(KEY_COLUMNS))
+    parser.add_argument('-k', '--cardinality', type=int, default=1000,
+        help='Number of distinct customers; regions and products scale with it.')
+    parser.add_argument('-m', '--members', type=int, default=4,
+        help='Number of files in a generated tarball.')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.output.endswith(('.tar', '.tar.gz', '.tar.bz2')):
+        write_tarball(args.output, args.rows, args.columns, args.cardinality,
+            args.members, args.seed)
+    else:
+        write_csv(args.output, args.rows, args.columns, args.cardinality, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""Measure csv_pivot throughput and peak memory over synthetic inputs."""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CSV_PIVOT = os.path.join(os.path.dirname(HERE), 'csv_pivot.py')
+
+sys.path.insert(0, os.path.dirname(CSV_PIVOT))
+import csv_pivot
+
+SCENARIOS = sorted(glob.glob(os.path.join(HERE, 'scenarios', '*.yaml')))
+
+MODES = ('plain', 'tarball')
+
+
+def _wait(pid):
+    # os.wait4 gives the resource usage of this very child, whereas
+    # getrusage(RUSAGE_CHILDREN) keeps the maximum over all past children.
+    _, status, rusage = os.wait4(pid, 0)
+    returncode = os.WEXITSTATUS(status)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, 'csv_pivot')
+    return rusage.ru_maxrss
+
+
+def run_cli(scenario, sources, workdir):
+    cmd = [sys.executable, CSV_PIVOT, scenario] + sources
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(cmd, cwd=workdir, stdout=devnull, stderr=devnull)
+        return _wait(proc.pid)
+
+
+def run_library(scenario, sources, workdir):
+    # Run in a forked child of this already warm process: no interpreter
+    # startup nor imports are measured, and peak memory stays per run.
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.chdir(workdir)
+            os.dup2(os.open(os.devnull, os.O_WRONLY), 2)
+            with open(scenario) as f:
+                pivot = csv_pivot.Pivot(csv_pivot.load_scenario(f))
+            csv_pivot.pivot_files([pivot], sources)
+            csv_pivot.write(pivot)
+            status = 0
+        finally:
+            os._exit(status)
+    return _wait(pid)
+
+
+ENGINES = {
+    'cli': run_cli,
+    'library': run_library,
+}
+
+
+def prepare_sources(datadir, mode, args):
+    if mode == 'plain':
+        path = os.path.join(datadir, 'source.csv')
+        generate.write_csv(path, args.rows, args.columns, args.cardinality)
+    else:
+        path = os.path.join(datadir, 'source.tar.gz')
+        generate.write_tarball(path, args.rows, args.columns, args.cardinality)
+    return [path]
+
+
+def measure(engine, scenario, sources, repeat):
+    best = None
+    peak = 0
+    for _ in range(repeat):
+        workdir = tempfile.mkdtemp()
+        try:
+            start = time.time()
+            maxrss = ENGINES[engine](scenario, sources, workdir)
+            elapsed = time.time() - start
+        finally:
+            shutil.rmtree(workdir)
+        best = elapsed if best is None else min(best, elapsed)
+        peak = max(peak, maxrss)
+    return best, peak
+
+
+def compare(results, baseline, tolerance):
+    key = lambda r: (r['engine'], r['mode'], r['scenario'])
+    previous = {key(r): r for r in baseline}
+    regressions = 0
+    for result in results:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        change = result['rows_per_s'] / before['rows_per_s'] - 1
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('{engine:<10} {mode:<8} {scenario:<20}'.format(**result),
+            '{:+.1%}{}'.format(change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('-r', '--rows', type=int, default=100000)
+    parser.add_argument('-c', '--columns', type=int, default=len(generate.KEY_COLUMNS))
+    parser.add_argument('-k', '--cardinality', type=int, default=1000)
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+        help='Runs per measure; the fastest one is kept.')
+    parser.add_argument('-e', '--engine', action='append', choices=sorted(ENGINES),
+        help='Engine to measure (default: all).')
+    parser.add_argument('-m', '--mode', action='append', choices=MODES,
+        help='Input mode to measure (default: all).')
+    parser.add_argument('-s', '--scenario', action='append',
+        help='Scenario file (default: bundled scenarios).')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this path.')
+    parser.add_argument('-b', '--baseline', help='Compare against a previous JSON output.')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+        help='Relative rows/s drop reported as a regression.')
+    args = parser.parse_args()
+
+    engines = args.engine or sorted(ENGINES)
+    modes = args.mode or MODES
+    scenarios = [os.path.abspath(p) for p in args.scenario or SCENARIOS]
+
+    results = []
+    datadir = tempfile.mkdtemp()
+    try:
+        print('{:<10} {:<8} {:<20} {:>12} {:>10}'.format(
+            'engine', 'mode', 'scenario', 'rows/s', 'peak kB'))
+        for mode in modes:
+            sources = prepare_sources(datadir, mode, args)
+            for scenario in scenarios:
+                for engine in engines:
+                    seconds, peak = measure(engine, scenario, sources, args.repeat)
+                    result = {
+                        'engine': engine,
+                        'mode': mode,
+                        'scenario': os.path.splitext(os.path.basename(scenario))[0],
+                        'rows': args.rows,
+                        'columns': args.columns,
+                        'cardinality': args.cardinality,
+                        'seconds': seconds,
+                        'rows_per_s': args.rows / seconds,
+                        'peak_rss_kb': peak,
+                    }
+                    results.append(result)
+                    print('{engine:<10} {mode:<8} {scenario:<20} '
+                        '{rows_per_s:>12.0f} {peak_rss_kb:>10}'.format(**result))
+    finally:
+        shutil.rmtree(datadir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
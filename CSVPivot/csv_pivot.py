@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 
 import argparse
+import ast
 import atexit
 import collections
 import contextlib
 import csv
+import fnmatch
 import itertools
 import operator
 import os
@@ -13,61 +15,165 @@ import tempfile
 import sys
 import yaml
 
-from collections import namedtuple
-from operator import itemgetter, attrgetter
+from operator import itemgetter
 
 import pyma.fs
 import pyma.log
 
+import sketches
 
-parser = argparse.ArgumentParser(__doc__)
-parser.add_argument('scenario', type=argparse.FileType('r'), help='Path to scenario file.')
-parser.add_argument('filenames', nargs='*', metavar='source', help='Path to source file.')
-args = parser.parse_args()
 
+META_NAMES = ('filename', 'column_header', 'row_header')
 
-scenario = yaml.load(args.scenario)
 
-Record = namedtuple('Record', ('meta', 'row'))
+def load_scenario(fileobj):
+    return yaml.load(fileobj)
 
-def map(rows):
-    for row in rows:
-        meta = {name: eval(u'lambda row: {}'.format(code))(row)
-            for name, code in scenario.items()
-            if name in ('filename', 'column_header', 'row_header')
-        }
-        if scenario['value'].startswith('sum(1'):
-            row = []
-        yield Record(meta, row)
 
+def load_scenarios(fileobj):
+    """Load every scenario of a file.
 
-groupby = (lambda rows, key: itertools.groupby(sorted(rows, key=key), key=key))
-
+    A file holds one scenario, a list of scenarios, or several YAML
+    documents each holding one or a list of them.
+    """
+    scenarios = []
+    for document in yaml.load_all(fileobj):
+        if isinstance(document, list):
+            scenarios.extend(document)
+        elif document is not None:
+            scenarios.append(document)
+    return scenarios
 
-def reduce(records):
-    for meta, record_group in groupby(records, key=attrgetter('meta')):
-        rows = [record.row for record in record_group]
-        value = eval(u'lambda rows: {}'.format(scenario['value']))(rows)
-        metric = dict(meta, value=value)
-        yield metric
 
+groupby = (lambda rows, key: itertools.groupby(sorted(rows, key=key), key=key))
 
 uniq = lambda values: list(collections.OrderedDict.fromkeys(values))
 to_int = lambda v: int(v) if isinstance(v, basestring) and v.isdigit() else v
 num_sorted = lambda values: sorted(values, key=to_int)
 
 
-def format(metrics):
-    for filename, metric_group in groupby(metrics, key=itemgetter('filename')):
-        metric_group = list(metric_group)
-        fieldnames = num_sorted(uniq(m['column_header'] for m in metric_group))
-        fieldnames.insert(0, scenario['column_header_name'][1:-1])
-        rows = []
-        for row_header, metric_subgroup in groupby(metric_group, key=itemgetter('row_header')):
-            row = {m['column_header']: m['value'] for m in metric_subgroup}
-            row[scenario['column_header_name'][1:-1]] = row_header
-            rows.append(row)
-        yield filename, fieldnames, rows
+def _is_aggregator_call(code):
+    node = ast.parse(code.strip(), mode='eval').body
+    return (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+        and node.func.id in sketches.AGGREGATORS)
+
+
+class Pivot(object):
+    """Aggregate rows according to a scenario.
+
+    Expressions are compiled once, rows can be fed in several batches and
+    results can be produced at any time, so a single process can run any
+    number of pivots.
+
+    When the value is one of the `approx_*` aggregators of the sketches
+    module, each cell keeps a fixed-size sketch instead of its rows. Pivots
+    pickle without their compiled expressions, so partial pivots computed
+    by other processes can be sent back and merged.
+    """
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.names = tuple(name for name in META_NAMES if name in scenario)
+        patterns = scenario.get('sources') or []
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        self.patterns = patterns
+        self.approximate = _is_aggregator_call(scenario['value'])
+        self._groups = {}
+        self._compile()
+
+    def _compile(self):
+        scenario = self.scenario
+        # One call per row computes the whole group key.
+        self._key = eval(u'lambda row: ({},)'.format(
+            ', '.join(scenario[name] for name in self.names)))
+        if self.approximate:
+            namespace = dict(globals(), **sketches.AGGREGATORS)
+            self._value = eval(u'lambda row: {}'.format(scenario['value']), namespace)
+        else:
+            self._value = eval(u'lambda rows: {}'.format(scenario['value']))
+        # Counting scenarios do not look at rows, don't keep them alive.
+        self._count_only = scenario['value'].startswith('sum(1')
+        self._filter = None
+        if scenario.get('filter'):
+            self._filter = eval(u'lambda row: {}'.format(scenario['filter']))
+
+    def __getstate__(self):
+        return {'scenario': self.scenario, 'groups': self._groups}
+
+    def __setstate__(self, state):
+        self.__init__(state['scenario'])
+        self._groups = state['groups']
+
+    def accepts(self, filename):
+        """Tell whether rows of the given source file are of interest."""
+        if not self.patterns:
+            return True
+        filename = os.path.basename(filename)
+        return any(fnmatch.fnmatch(filename, pattern) for pattern in self.patterns)
+
+    def feed(self, rows):
+        groups = self._groups
+        key = self._key
+        count_only = self._count_only
+        if self._filter is not None:
+            rows = itertools.ifilter(self._filter, rows)
+        if self.approximate:
+            return self._feed_sketches(rows)
+        for row in rows:
+            k = key(row)
+            group = groups.get(k)
+            if group is None:
+                group = groups[k] = []
+            group.append(() if count_only else row)
+
+    def _feed_sketches(self, rows):
+        groups = self._groups
+        key = self._key
+        sample = self._value
+        for row in rows:
+            k = key(row)
+            (factory, args), value = sample(row)
+            sketch = groups.get(k)
+            if sketch is None:
+                sketch = groups[k] = factory(*args)
+            sketch.add(value)
+
+    def merge(self, other):
+        """Add the groups of another pivot of the same scenario."""
+        groups = self._groups
+        for k, group in other._groups.items():
+            if k not in groups:
+                groups[k] = group
+            elif self.approximate:
+                groups[k].merge(group)
+            else:
+                groups[k].extend(group)
+
+    def reset(self):
+        self._groups = {}
+
+    def metrics(self):
+        for key, group in self._groups.items():
+            metric = dict(zip(self.names, key))
+            if self.approximate:
+                metric['value'] = group.result()
+            else:
+                metric['value'] = self._value(group)
+            yield metric
+
+    def results(self):
+        header_name = self.scenario['column_header_name'][1:-1]
+        for filename, metric_group in groupby(self.metrics(), key=itemgetter('filename')):
+            metric_group = list(metric_group)
+            fieldnames = num_sorted(uniq(m['column_header'] for m in metric_group))
+            fieldnames.insert(0, header_name)
+            rows = []
+            for row_header, metric_subgroup in groupby(metric_group, key=itemgetter('row_header')):
+                row = {m['column_header']: m['value'] for m in metric_subgroup}
+                row[header_name] = row_header
+                rows.append(row)
+            yield filename, fieldnames, rows
 
 
 _is_tarball = lambda filename: (
@@ -78,7 +184,7 @@ _is_tarball = lambda filename: (
 
 
 @contextlib.contextmanager
-def open_source_files(filepaths):
+def open_source_files(filepaths, accept=None):
     tmpdirs = []
     def _delete(paths):
         for path in paths:
@@ -97,13 +203,18 @@ def open_source_files(filepaths):
                 tmpdirs.append(tmpdir)
                 pyma.log.info('extracting {} to {}'.format(filepath, tmpdir))
                 archive = tarfile.open(filepath)
-                archive.extractall(tmpdir)
+                members = [m for m in archive.getmembers()
+                    if accept is None or not m.isfile() or accept(m.name)]
+                archive.extractall(tmpdir, members)
                 for path, dirnames, filenames in os.walk(tmpdir):
                     for filename in filenames:
                         filepath = os.path.join(path, filename)
                         pyma.log.info('reading {}'.format(filepath))
                         yield open(filepath)
                 continue
+            if accept is not None and not accept(filepath):
+                pyma.log.info('skipping {}'.format(filepath))
+                continue
             pyma.log.info('reading {}'.format(filepath))
             yield open(filepath)
     yield _open_source_files(filepaths)
@@ -111,24 +222,58 @@ def open_source_files(filepaths):
 
 
 
-def main():
-    with open_source_files(args.filenames) as files:
-        readers = (csv.DictReader(f, delimiter=';') for f in files)
-        reader = itertools.chain.from_iterable(readers)
+def pivot_files(pivots, filepaths, batch_size=10000):
+    # Sources are read and parsed once whatever the number of pivots; rows
+    # are handed over in batches to keep per-row overhead low. Files no
+    # pivot is interested in are neither extracted nor read.
+    accept = None
+    if all(pivot.patterns for pivot in pivots):
+        accept = lambda filename: any(pivot.accepts(filename) for pivot in pivots)
+    with open_source_files(filepaths, accept) as files:
+        for f in files:
+            targets = pivots
+            if f is not sys.stdin:
+                targets = [pivot for pivot in pivots if pivot.accepts(f.name)]
+            reader = csv.DictReader(f, delimiter=';')
+            while True:
+                rows = list(itertools.islice(reader, batch_size))
+                if not rows:
+                    break
+                for pivot in targets:
+                    pivot.feed(rows)
+    return pivots
+
 
-    metrics = reduce(map(reader))
+def write(pivot):
     filenames = []
-    for filename, fieldnames, rows in format(metrics):
+    for filename, fieldnames, rows in pivot.results():
         pyma.log.info('writing {}'.format(filename))
         with open(filename, 'w') as fdout:
             writer = csv.DictWriter(fdout, fieldnames=fieldnames,
-                delimiter=';', restval=scenario['default'])
+                delimiter=';', restval=pivot.scenario['default'])
             writer.writeheader()
             for row in rows:
                 writer.writerow(row)
         filenames.append(filename)
+    return filenames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('scenario', type=argparse.FileType('r'), help='Path to scenario file.')
+    parser.add_argument('filenames', nargs='*', metavar='source', help='Path to source file.')
+    parser.add_argument('-s', '--scenario', dest='scenarios', action='append', default=[],
+        type=argparse.FileType('r'), help='Path to another scenario file, evaluated in the same pass.')
+    args = parser.parse_args(argv)
+
+    pivots = [Pivot(scenario)
+        for f in [args.scenario] + args.scenarios
+        for scenario in load_scenarios(f)
+    ]
+    pivot_files(pivots, args.filenames)
+    for pivot in pivots:
+        write(pivot)
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,154 @@
+"""Fixed-size, mergeable approximate aggregators.
+
+Scenarios use them through the `approx_*` functions, whose result for a
+row tells the pivot which sketch to build for the cell and which value to
+add to it, e.g.:
+
+    value: "approx_distinct(row['customer'])"
+    value: "approx_quantile(float(row['amount']), 0.95)"
+"""
+
+import hashlib
+import math
+import struct
+
+
+def _hash64(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = repr(value)
+    # A stable hash, unlike hash(), so that sketches built by different
+    # processes can be merged.
+    return struct.unpack('<Q', hashlib.md5(value).digest()[:8])[0]
+
+
+class HyperLogLog(object):
+    """Distinct count estimate using 2 ** precision one byte registers.
+
+    The standard error is about 1.04 / sqrt(2 ** precision), i.e. 1.6%
+    with the default precision.
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        x = _hash64(value)
+        bits = 64 - self.precision
+        w = x & ((1 << bits) - 1)
+        rank = bits - w.bit_length() + 1
+        j = x >> bits
+        if rank > self.registers[j]:
+            self.registers[j] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('cannot merge HyperLogLog of different precisions')
+        registers = self.registers
+        for j, rank in enumerate(other.registers):
+            if rank > registers[j]:
+                registers[j] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(b'\x00')
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction: linear counting is more accurate.
+            estimate = m * math.log(float(m) / zeros)
+        return estimate
+
+    def result(self):
+        return int(round(self.estimate()))
+
+
+class QuantileSketch(object):
+    """KLL quantile sketch.
+
+    Items are kept in a hierarchy of compactors; a full compactor sorts
+    its items and promotes every other one to the next level, where it
+    weighs twice as much. Memory is O(k) items for practical stream sizes.
+    """
+
+    def __init__(self, q=0.5, k=200):
+        self.q = q
+        self.k = k
+        self.compactors = []
+        self.size = 0
+        self.max_size = 0
+        self._offset = 0
+        self._grow()
+
+    def _capacity(self, height):
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil(self.k * (2.0 / 3) ** depth)) + 1
+
+    def _grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def _compress(self):
+        for height, items in enumerate(self.compactors):
+            if len(items) < self._capacity(height):
+                continue
+            if height + 1 == len(self.compactors):
+                self._grow()
+            items.sort()
+            # Keep the lowest item of an odd count, and alternate which
+            # half is promoted so as not to bias the estimates.
+            start = len(items) % 2
+            self._offset ^= 1
+            self.compactors[height + 1].extend(items[start + self._offset::2])
+            del items[start:]
+            self.size = sum(len(c) for c in self.compactors)
+            if self.size < self.max_size:
+                break
+
+    def add(self, value):
+        self.compactors[0].append(value)
+        self.size += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for height, items in enumerate(other.compactors):
+            self.compactors[height].extend(items)
+        self.size = sum(len(c) for c in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+
+    def quantile(self, q):
+        weighted = sorted((value, 1 << height)
+            for height, items in enumerate(self.compactors)
+            for value in items)
+        if not weighted:
+            return None
+        target = q * sum(weight for _, weight in weighted)
+        cumulated = 0
+        for value, weight in weighted:
+            cumulated += weight
+            if cumulated >= target:
+                return value
+        return weighted[-1][0]
+
+    def result(self):
+        return self.quantile(self.q)
+
+
+def approx_distinct(value, precision=12):
+    return (HyperLogLog, (precision,)), value
+
+
+def approx_quantile(value, q=0.5, k=200):
+    return (QuantileSketch, (q, k)), value
+
+
+AGGREGATORS = {
+    'approx_distinct': approx_distinct,
+    'approx_quantile': approx_quantile,
+}
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""Format whole source trees with PrettyPy in a pool of processes."""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import difflib
+import multiprocessing
+import os
+import sys
+import time
+
+import prettypy
+
+from cache import FormatCache
+
+
+def iter_source_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.endswith('.py'):
+                    yield os.path.join(dirpath, filename)
+
+
+def format_path(job):
+    """Format one file; return (path, status, seconds, output, error, stats).
+
+    The status is one of 'cached', 'unchanged' or 'changed'; stats counts
+    the nodes written by type when asked for, else is None.
+    """
+    path, mode, width, cache, stats = job
+    stats = collections.Counter() if stats else None
+    start = time.time()
+    try:
+        stat = os.stat(path)
+        if cache is not None and cache.knows_stat(path, stat):
+            return path, 'cached', time.time() - start, '', None, stats
+        with open(path, 'rb') as f:
+            content = f.read()
+        if cache is not None and cache.knows_content(content):
+            return path, 'cached', time.time() - start, '', None, stats
+        formatted = prettypy.format_source(content, width, stats)
+        changed = formatted != content
+        output = ''
+        if not changed and cache is not None:
+            cache.add(path, stat, content)
+        if changed and mode == 'in-place':
+            with open(path, 'wb') as f:
+                f.write(formatted)
+        elif changed and mode == 'diff':
+            output = ''.join(difflib.unified_diff(
+                content.splitlines(True), formatted.splitlines(True),
+                'a/' + path, 'b/' + path))
+        error = None
+    except Exception as e:
+        changed, output, error = False, '', '{}: {}'.format(type(e).__name__, e)
+    status = 'changed' if changed else 'unchanged'
+    return path, status, time.time() - start, output, error, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('paths', nargs='+', metavar='path', help='File or directory to format.')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-i', '--in-place', dest='mode', action='store_const', const='in-place',
+        help='Rewrite files that need formatting.')
+    group.add_argument('-d', '--diff', dest='mode', action='store_const', const='diff',
+        help='Print a diff for files that need formatting.')
+    group.add_argument('-c', '--check', dest='mode', action='store_const', const='check',
+        help='Only report files that need formatting.')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+        help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument('-w', '--width', type=int, default=79,
+        help='Maximum line length (default: %(default)s).')
+    parser.add_argument('-t', '--timings', action='store_true',
+        help='Report formatting time of each file.')
+    parser.add_argument('--stats', action='store_true',
+        help='Report how many nodes of each type were written, and copied verbatim.')
+    parser.add_argument('--cache-dir', default=os.path.expanduser('~/.cache/prettypy'),
+        help='Where to remember already formatted files (default: %(default)s).')
+    parser.add_argument('--no-cache', action='store_true',
+        help='Format every file, whether known formatted or not.')
+    parser.set_defaults(mode='check')
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else FormatCache(args.cache_dir, [('width', args.width)])
+    start = time.time()
+    jobs = ((path, args.mode, args.width, cache, args.stats) for path in iter_source_files(args.paths))
+    pool = None
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap_unordered(format_path, jobs, chunksize=4)
+    else:
+        results = (format_path(job) for job in jobs)
+
+    count = changed_count = error_count = cached_count = 0
+    stats = collections.Counter()
+    for path, status, seconds, output, error, file_stats in results:
+        count += 1
+        if file_stats:
+            stats.update(file_stats)
+        cached_count += status == 'cached'
+        changed = status == 'changed'
+        if args.timings:
+            print('{:8.3f}s {}'.format(seconds, path), file=sys.stderr)
+        if error is not None:
+            error_count += 1
+            print('error: {}: {}'.format(path, error), file=sys.stderr)
+        elif changed:
+            changed_count += 1
+            if args.mode == 'diff':
+                sys.stdout.write(output)
+            else:
+                verb = 'reformatted' if args.mode == 'in-place' else 'would reformat'
+                print('{} {}'.format(verb, path))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    if cache is not None:
+        cache.evict()
+
+    if args.stats:
+        prettypy.print_stats(stats)
+
+    print('{} files ({} cached), {} {}, {} failed in {:.2f}s ({:.1f} files/s)'.format(
+        count, cached_count, changed_count,
+        'reformatted' if args.mode == 'in-place' else 'would change',
+        error_count, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+    if error_count or (changed_count and args.mode != 'in-place'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Measure PrettyPy throughput over a corpus and check its output round-trips.
+
+Every output is parsed again and its AST compared with the one of the
+original source, so that a faster formatter cannot silently produce code
+that means something else. The same goes for the formatting of random
+line ranges of each file, when asked for.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import ast
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+import prettypy
+
+from batch import iter_source_files
+
+
+def _header(content):
+    # Shebang and coding lines, which only count within the first two.
+    return [line for line in content.splitlines()[:2]
+        if line.startswith(b'#!') or prettypy._CODING.match(line)]
+
+
+def verify(content, formatted):
+    """Return None if formatted means the same as content, else why not."""
+    try:
+        tree = ast.parse(formatted)
+    except SyntaxError as e:
+        return 'invalid: {}'.format(e)
+    if ast.dump(tree) != ast.dump(ast.parse(content)):
+        return 'changed'
+    # ast.parse ignores where the coding cookie is, Python does not.
+    if _header(formatted) != _header(content):
+        return 'header moved'
+    return None
+
+
+def verify_ranges(content, count, rng, size=8):
+    """Format count random ranges of content, return why one failed or None."""
+    lines = content.count(b'\n')
+    for _ in range(count if lines else 0):
+        first = rng.randint(1, lines)
+        last = min(lines, first + rng.randint(0, size - 1))
+        failure = verify(content, prettypy.format_ranges(content, [(first, last)]))
+        if failure:
+            return 'lines {}-{}: {}'.format(first, last, failure)
+    return None
+
+
+def run(paths, repeat=1, ranges=0, seed=0):
+    rng = random.Random(seed)
+    results = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+        try:
+            ast.parse(content)
+        except SyntaxError:
+            # Not part of the corpus: the formatter is not to blame.
+            continue
+        result = {'path': path, 'lines': content.count(b'\n'), 'seconds': None}
+        try:
+            for _ in range(repeat):
+                start = time.time()
+                formatted = prettypy.format_source(content)
+                elapsed = time.time() - start
+                if result['seconds'] is None or elapsed < result['seconds']:
+                    result['seconds'] = elapsed
+            result['failure'] = verify(content, formatted) or verify_ranges(content, ranges, rng)
+        except Exception as e:
+            result['failure'] = 'error: {}: {}'.format(type(e).__name__, e)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('paths', nargs='*', metavar='path',
+        help='Corpus files or directories (default: the standard library).')
+    parser.add_argument('-n', '--repeat', type=int, default=1,
+        help='Times each file is formatted; the fastest one is kept.')
+    parser.add_argument('-r', '--ranges', type=int, default=0,
+        help='Random line ranges of each file to format and verify too.')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Seed of the random ranges.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='Report each file failing verification.')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this path.')
+    parser.add_argument('-b', '--baseline',
+        help='Fail if files verified in this previous JSON output no longer are.')
+    args = parser.parse_args()
+
+    paths = list(iter_source_files(args.paths or [os.path.dirname(os.__file__)]))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results = run(paths, args.repeat, args.ranges, args.seed)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timed = [r for r in results if r['seconds'] is not None]
+    lines = sum(r['lines'] for r in timed)
+    seconds = sum(r['seconds'] for r in timed)
+    failures = [r for r in results if r['failure']]
+    if args.verbose:
+        for result in failures:
+            print('{path}: {failure}'.format(**result))
+    print('{} files, {} lines in {:.2f}s: {:.0f} lines/s'.format(
+        len(timed), lines, seconds, lines / seconds if seconds else 0))
+    print('peak RSS {} kB ({:+} kB while formatting)'.format(rss_after, rss_after - rss_before))
+    print('{} of {} files verified, {} failed'.format(
+        len(results) - len(failures), len(results), len(failures)))
+
+    if args.output:
+        summary = {
+            'version': prettypy.__version__,
+            'lines_per_s': lines / seconds if seconds else 0,
+            'peak_rss_kb': rss_after,
+            'files': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        verified = set(r['path'] for r in baseline['files'] if not r['failure'])
+        broken = sorted(r['path'] for r in failures if r['path'] in verified)
+        for path in broken:
+            print('regression: {}'.format(path))
+        if broken:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
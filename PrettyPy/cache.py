@@ -0,0 +1,92 @@
+"""On-disk record of the sources PrettyPy leaves unchanged."""
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import hashlib
+import os
+import time
+
+import prettypy
+
+
+class FormatCache(object):
+    """Remember which sources are already formatted.
+
+    Each known source is an empty file named after a hash of the
+    formatter version, the options and either the content of the source
+    or its path, size and modification time. Entries are created with a
+    single exclusive open() and never modified, so any number of
+    processes may share a cache directory; hits refresh the entry's
+    modification time and evict() removes entries unused for max_age
+    seconds.
+    """
+
+    def __init__(self, directory, options=(), max_age=30 * 24 * 3600):
+        self.directory = directory
+        self.max_age = max_age
+        self.salt = '{}:{!r}:'.format(prettypy.__version__, sorted(options))
+
+    def _path(self, *parts):
+        digest = hashlib.sha1(self.salt)
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else repr(part))
+            digest.update(b'\0')
+        key = digest.hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _stat_path(self, path, stat):
+        return self._path('stat', os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+    def _content_path(self, content):
+        return self._path('content', content)
+
+    def _hit(self, entry):
+        try:
+            os.utime(entry, None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        return True
+
+    def _add(self, entry):
+        try:
+            os.makedirs(os.path.dirname(entry))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        try:
+            os.close(os.open(entry, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def knows_stat(self, path, stat):
+        """Tell from os.stat() alone whether path is known formatted."""
+        return self._hit(self._stat_path(path, stat))
+
+    def knows_content(self, content):
+        return self._hit(self._content_path(content))
+
+    def add(self, path, stat, content):
+        """Record that the file at path, with this content, is formatted."""
+        self._add(self._content_path(content))
+        self._add(self._stat_path(path, stat))
+
+    def evict(self):
+        """Remove entries not used for max_age seconds, return how many."""
+        limit = time.time() - self.max_age
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                entry = os.path.join(dirpath, filename)
+                try:
+                    if os.stat(entry).st_mtime < limit:
+                        os.remove(entry)
+                        count += 1
+                except OSError as e:
+                    # Another process evicted or refreshed it meanwhile.
+                    if e.errno != errno.ENOENT:
+                        raise
+        return count
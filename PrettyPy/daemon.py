@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Keep PrettyPy warm in a daemon serving format requests on a Unix socket.
+
+A request is a JSON header line, e.g. {"lines": [[10, 20]], "width": 79},
+followed by the source; the client then shuts down its sending side. The
+response is a JSON header line, {"status": "ok" | "error", "error": ...,
+"elapsed": ...}, followed by the formatted source.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import errno
+import json
+import os
+import signal
+import socket
+import SocketServer
+import stat
+import sys
+import tempfile
+import time
+
+import prettypy
+
+
+# The runtime directory is private to the user; the shared temporary one
+# is only a fallback, where request() checks who owns the socket.
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+    'prettypy-{}.sock'.format(os.getuid()))
+
+
+def _read_all(fileobj):
+    header = json.loads(fileobj.readline())
+    return header, fileobj.read()
+
+
+class FormatHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        start = time.time()
+        output = b''
+        try:
+            header, content = _read_all(self.rfile)
+            width = header.get('width') or 79
+            if header.get('lines'):
+                output = prettypy.format_ranges(content, header['lines'], width)
+            else:
+                output = prettypy.format_source(content, width)
+            response = {'status': 'ok'}
+        except Exception as e:
+            response = {'status': 'error', 'error': '{}: {}'.format(type(e).__name__, e)}
+        response['elapsed'] = time.time() - start
+        self.wfile.write(json.dumps(response) + b'\n')
+        self.wfile.write(output)
+        print('{:8.3f}ms {} {} bytes'.format(response['elapsed'] * 1000,
+            response['status'], len(output)), file=sys.stderr)
+
+
+class FormatServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    # Each request is served by a fork of the warm daemon: requests run
+    # concurrently on all cores and a crash only loses its own request.
+    pass
+
+
+def serve(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    umask = os.umask(0o077)
+    try:
+        server = FormatServer(path, FormatHandler)
+    finally:
+        os.umask(umask)
+    print('serving on {}'.format(path), file=sys.stderr)
+    pid = os.getpid()
+
+    def terminate(signum, frame):
+        if os.getpid() != pid:
+            # A fork serving a request: it owns nothing to clean up.
+            os._exit(128 + signum)
+        # Unwinds serve_forever() so that the socket is removed.
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def request(path, content, lines=None, width=79):
+    """Send a source to the daemon, return (response header, output).
+
+    Raise IOError if the socket is not one of the current user: another
+    user could otherwise answer with any source.
+    """
+    st = os.stat(path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise IOError(errno.EPERM, 'not a socket of the current user', path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps({'lines': lines, 'width': width}) + b'\n')
+        sock.sendall(content)
+        sock.shutdown(socket.SHUT_WR)
+        return _read_all(sock.makefile('rb'))
+    finally:
+        sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET,
+        help='Path to the daemon socket (default: %(default)s).')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('serve', help='Run the daemon.')
+    client = subparsers.add_parser('format', help='Format a file through the daemon.')
+    client.add_argument('filepath', help="Path to source file, '-' for stdin.")
+    client.add_argument('-l', '--lines', type=prettypy.parse_line_range, action='append',
+        metavar='FIRST-LAST', help='Only format statements touching these lines.')
+    client.add_argument('-w', '--width', type=int, default=79,
+        help='Maximum line length (default: %(default)s).')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        try:
+            serve(args.socket)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.filepath == '-':
+        content = sys.stdin.read()
+    else:
+        with open(args.filepath, 'rb') as f:
+            content = f.read()
+    try:
+        header, output = request(args.socket, content, args.lines, args.width)
+    except (IOError, socket.error) as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+    if header['status'] != 'ok':
+        print('error: {}'.format(header['error']), file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(output)
+
+
+if __name__ == '__main__':
+    main()
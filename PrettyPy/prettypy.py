@@ -1,513 +1,1293 @@
 #!/usr/bin/env python
 
-# Bugs:
-#   - (a + b) * c --> a + b * c
-
 # Todo:
 #   - Rework lines management
 #   - Rework spaces management
-#   - Rework comments management
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import argparse
 import ast
+import bisect
+import collections
+import io
 import StringIO
+import __future__
+import re
+import sys
 import tokenize
 
 import pyma
 
 
-chunks = []
-
-
-def format_str(node, indent, ext=None):
-    chunks.append(node)
-
-
-def format_alias(node, indent, ext=None):
-    dispatch(node.name, indent)
-    if node.asname is not None:
-        chunks.append(' as ')
-        dispatch(node.asname, indent)
-
-
-def format_NoneType(node, indent, ext=None):
-    chunks.append(' None ')
-
-
-def format_int(node, indent, ext=None):
-    chunks.append(str(node))
-
-
-def format_ImportFrom(node, indent, ext=None):
-    chunks.append('    ' * indent)
-    chunks.append('from ')
-    dispatch(node.module, indent)
-    chunks.append(' import ')
-    for subnode in node.names:
-        dispatch(subnode, indent)
-        chunks.append(', ')
-    if node.names:
-        chunks.pop()
-    #node.level
-
-
-def format_Import(node, indent, ext=None):
-    chunks.append('    ' * indent)
-    chunks.append('import ')
-    for subnodes in node.names:
-        dispatch(subnodes, indent)
-        chunks.append(', ')
-    if node.names:
-        chunks.pop()
-
-
-def format_FunctionDef(node, indent, ext=None):
-    for subnode in node.decorator_list:
-        chunks.append('    ' * indent)
-        chunks.append('@')
-        dispatch(subnode, indent)
-        chunks.append('\n')
-    chunks.append('    ' * indent)
-    chunks.append('def ')
-    dispatch(node.name, indent)
-    chunks.append('(')
-    dispatch(node.args, indent)
-    chunks.append('):\n')
-    indent += 1
-    prev = None
-    for subnode in node.body:
-        chunks.append('    ' * indent)
-        dispatch(subnode, indent)
-        chunks.append('\n')
-        prev = subnode
-    if node.body:
-        chunks.pop()
-
-
-def format_arguments(node, indent, ext=None):
-    no_default_arg_count = len(node.args) - len(node.defaults)
-    for i, subnode in enumerate(node.args, - no_default_arg_count):
-        dispatch(subnode, indent)
-        if i >= 0:
-            chunks.append('=')
-            dispatch(node.defaults[i], indent)
-        chunks.append(', ')
-    if node.args:
-        chunks.pop()
-    #node.vararg
-    #node.kwarg
-
-
-def format_Attribute(node, indent, ext=None):
-    dispatch(node.value, indent)
-    chunks.append('.')
-    chunks.append(node.attr)
-
-
-def format_IsNot(node, indent, ext=None):
-    chunks.append(' is not ')
-
-
-def format_Not(node, indent, ext=None):
-    chunks.append('not')
-
-
-def format_While(node, indent, ext=None):
-    chunks.append('while ')
-    dispatch(node.test, indent)
-    chunks.append(':')
-    chunks.append('\n')
-    indent += 1
-    for subnode in node.body:
-        chunks.append('    ' * indent)
-        dispatch(subnode, indent)
-        chunks.append('\n')
-    indent -= 1
-    if node.orelse:
-        chunks.append('    ' * indent)
-        chunks.append('else:')
-        chunks.append('\n')
-        indent += 1
-        for subnode in node.orelse:
-            chunks.append('    ' * indent)
-            dispatch(subnode, indent)
-            chunks.append('\n')
-    if node.body or node.orelse:
-        chunks.pop()
-
-
-def format_For(node, indent, ext=None):
-    chunks.append('for ')
-    dispatch(node.target, indent)
-    chunks.append(' in ')
-    dispatch(node.iter, indent)
-    chunks.append(':')
-    chunks.append('\n')
-    indent += 1
-    for subnode in node.body:
-        chunks.append('    ' * indent)
-        dispatch(subnode, indent)
-        chunks.append('\n')
-    indent -= 1
-    if node.orelse:
-        chunks.append('    ' * indent)
-        chunks.append('else:')
-        chunks.append('\n')
-        indent += 1
-        for subnode in node.orelse:
-            chunks.append('    ' * indent)
-            dispatch(subnode, indent)
-            chunks.append('\n')
-    if node.body or node.orelse:
-        chunks.pop()
-
-
-def format_NotIn(node, indent, ext=None):
-    chunks.append(' not in ')
-
-
-def format_Break(node, indent, ext=None):
-    chunks.append('break')
-
-
-def format_In(node, indent, ext=None):
-    chunks.append(' in ')
-
-
-def format_And(node, indent, ext=None):
-    chunks.append(' and ')
-
-
-def format_Is(node, indent, ext=None):
-    chunks.append(' is ')
-
-
-def format_IfExp(node, indent, ext=None):
-    dispatch(node.body, indent)
-    chunks.append(' if ')
-    dispatch(node.test, indent)
-    chunks.append(' else ')
-    dispatch(node.orelse, indent)
-
-
-def format_Add(node, indent, ext=None):
-    chunks.append('+')
-
-
-def format_Or(node, indent, ext=None):
-    chunks.append(' or ')
-
-
-def format_Num(node, indent, ext=None):
-    chunks.append(str(node.n))
-
-
-def format_Sub(node, indent, ext=None):
-    chunks.append('-')
-
-
-def format_Lt(node, indent, ext=None):
-    chunks.append(' < ')
-
-
-def format_LtE(node, indent, ext=None):
-    chunks.append(' <= ')
-
-
-def format_Gt(node, indent, ext=None):
-    chunks.append(' > ')
-
-
-def format_GtE(node, indent, ext=None):
-    chunks.append(' >= ')
-
-
-def format_USub(node, indent, ext=None):
-    chunks.append('-')
-
-
-def format_AugAssign(node, indent, ext=None):
-    dispatch(node.target, indent)
-    chunks.append(' ')
-    dispatch(node.op, indent)
-    chunks.append('=')
-    chunks.append(' ')
-    dispatch(node.value, indent)
-
-
-def format_Raise(node, indent, ext=None):
-    chunks.append('raise ')
-    dispatch(node.type, indent)
-    #node.inst
-    #node.tback
-
-
-def format_Subscript(node, indent, ext=None):
-    dispatch(node.value, indent)
-    chunks.append('[')
-    dispatch(node.slice, indent)
-    chunks.append(']')
-
-
-def format_With(node, indent, ext=None):
-    chunks.append('with ')
-    dispatch(node.context_expr, indent)
-    if node.optional_vars:
-        chunks.append(' as ')
-        dispatch(node.optional_vars, indent)
-    chunks.append(':')
-    chunks.append('\n')
-    indent += 1
-    for subnode in node.body:
-        chunks.append('    ' * indent)
-        dispatch(subnode, indent)
-        chunks.append('\n')
-    if node.body:
-        chunks.pop()
-
-
-def format_If(node, indent, ext=None):
-    chunks.append('if ')
-    if ext == 'elif':
-        chunks.pop()
-    dispatch(node.test, indent)
-    chunks.append(':')
-    chunks.append('\n')
-    indent += 1
-    for subnode in node.body:
-        chunks.append('    ' * indent)
-        dispatch(subnode, indent)
-        chunks.append('\n')
-    indent -= 1
-    if len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If):
-        chunks.append('    ' * indent)
-        chunks.append('elif ')
-        dispatch(node.orelse[0], indent, ext='elif')
-        chunks.append('\n')
-    elif node.orelse:
-        chunks.append('    ' * indent)
-        chunks.append('else:')
-        chunks.append('\n')
-        indent += 1
-        for subnode in node.orelse:
-            chunks.append('    ' * indent)
-            dispatch(subnode, indent)
-            chunks.append('\n')
-    if node.body or node.orelse:
-        chunks.pop()
-    indent -= 1
-
-
-def format_Compare(node, indent, ext=None):
-    dispatch(node.left, indent)
-    for subnode in node.ops:
-        dispatch(subnode, indent)
-    for subnode in node.comparators:
-        dispatch(subnode, indent)
-
-
-def format_Expr(node, indent, ext=None):
-    dispatch(node.value, indent)
-
-
-def format_Name(node, indent, ext=None):
-    chunks.append(node.id)
-
-
-def format_Call(node, indent, ext=None):
-    dispatch(node.func, indent)
-    chunks.append('(')
-    for subnode in node.args:
-        dispatch(subnode, indent)
-        chunks.append(', ')
-    for subnode in node.keywords:
-        dispatch(subnode, indent)
-        chunks.append(', ')
-    if node.args or node.keywords:
-        chunks.pop()
-    chunks.append(')')
-    #node.starargs
-    #node.kwargs
-
-
-def format_Eq(node, indent, ext=None):
-    chunks.append(' == ')
-
-
-def format_NotEq(node, indent, ext=None):
-    chunks.append(' != ')
-
-
-def format_Mult(node, indent, ext=None):
-    chunks.append('*')
-
-
-def format_Str(node, indent, ext=None):
-    quote = "'" if "'" not in node.s else '"'
-    chunks.append(quote)
-    chunks.append(node.s.encode('unicode_escape'))
-    chunks.append(quote)
-
-
-def format_DictComp(node, indent, ext=None):
-    chunks.append('{')
-    dispatch(node.key, indent)
-    chunks.append(': ')
-    dispatch(node.value, indent)
-    chunks.append(' ')
-    for subnode in node.generators:
-        dispatch(subnode, indent)
-    chunks.append('}')
-
-
-def format_ListComp(node, indent, ext=None):
-    chunks.append('[')
-    dispatch(node.elt, indent)
-    chunks.append(' ')
-    for subnode in node.generators:
-        dispatch(subnode, indent)
-    chunks.append(']')
-
-
-def format_comprehension(node, indent, ext=None):
-    chunks.append('for ')
-    dispatch(node.target, indent)
-    chunks.append(' in ')
-    dispatch(node.iter, indent)
-    if node.ifs:
-        chunks.append(' if ')
+# Bump whenever the output for a given input changes.
+__version__ = '0.8'
+
+
+COMPOUND_STATEMENTS = (
+    ast.ClassDef,
+    ast.For,
+    ast.FunctionDef,
+    ast.If,
+    ast.TryExcept,
+    ast.TryFinally,
+    ast.While,
+    ast.With,
+)
+
+
+class SourceIndex(object):
+    """Comments and blank lines of a source, collected in one token pass.
+
+    Comments are consumed in source order as statements are emitted, at
+    whatever depth, so placing all of them is linear in their number.
+    Tokens may come from a part of a source starting after line offset.
+    logical_lines maps each line of code to the first and last lines of
+    the logical line it belongs to. lines, when given, are the source
+    lines from line first_line on, for statements to be copied verbatim.
+    """
+
+    def __init__(self, tokens=(), offset=0, lines=(), first_line=None):
+        self.comments = collections.deque()
+        self.comment_lines = set()
+        self.blank_lines = set()
+        self.string_lines = set()
+        self.semicolon_lines = set()
+        self.logical_lines = {}
+        self.lines = lines
+        self.first_line = offset + 1 if first_line is None else first_line
+        first = last = None
+        for tok_type, text, start, end, line in tokens:
+            if tok_type == tokenize.COMMENT:
+                self.comments.append((start[0] + offset, text))
+                if line.lstrip().startswith(b'#'):
+                    self.comment_lines.add(start[0] + offset)
+            elif tok_type == tokenize.STRING and end[0] > start[0]:
+                # Lines starting within a string are not to be reindented.
+                self.string_lines.update(range(start[0] + offset + 1, end[0] + offset + 1))
+                if first is None:
+                    first = start[0] + offset
+                last = end[0] + offset
+            elif tok_type == tokenize.NL:
+                if not line.strip():
+                    self.blank_lines.add(start[0] + offset)
+            elif tok_type in (tokenize.INDENT, tokenize.DEDENT):
+                pass
+            elif tok_type == tokenize.OP and text == b';':
+                self.semicolon_lines.add(start[0] + offset)
+                last = end[0] + offset
+            elif tok_type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+                if first is not None:
+                    for row in range(first, last + 1):
+                        self.logical_lines[row] = (first, last)
+                first = None
+            else:
+                if first is None:
+                    first = start[0] + offset
+                last = end[0] + offset
+
+    def region(self, first, last):
+        """Index of the lines first to last only."""
+        index = SourceIndex(lines=self.lines, first_line=self.first_line)
+        index.logical_lines = self.logical_lines
+        index.string_lines = self.string_lines
+        index.semicolon_lines = self.semicolon_lines
+        index.comments.extend(c for c in self.comments if first <= c[0] <= last)
+        index.comment_lines.update(n for n in self.comment_lines if first <= n <= last)
+        index.blank_lines.update(n for n in self.blank_lines if first <= n <= last)
+        return index
+
+    def pop_until(self, lineno):
+        """Pop the text of comments up to and including line lineno."""
+        comments = self.comments
+        while comments and comments[0][0] <= lineno:
+            yield comments.popleft()[1]
+
+    def pop_all(self):
+        return self.pop_until(float('inf'))
+
+    def source(self, first, last):
+        """Source lines first to last, both included."""
+        return self.lines[first - self.first_line:last - self.first_line + 1]
+
+
+class Unsupported(Exception):
+    """Raised for a construct the emitter cannot write."""
+
+
+class Group(object):
+    """Part of a layout printed on one line when it fits, else broken."""
+
+    __slots__ = ('doc',)
+
+    def __init__(self, doc):
+        self.doc = doc
+
+
+class Nest(object):
+    """Part of a layout whose broken lines are indented further."""
+
+    __slots__ = ('indent', 'doc')
+
+    def __init__(self, indent, doc):
+        self.indent = indent
+        self.doc = doc
+
+
+class Line(object):
+    """Line break, or the flat text when its group fits on the line."""
+
+    __slots__ = ('flat',)
+
+    def __init__(self, flat):
+        self.flat = flat
+
+
+class IfBroken(object):
+    """Text printed only when its group is broken."""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+LINE = Line(' ')
+SOFTLINE = Line('')
+
+FLAT, BREAK = 0, 1
+
+_END = object()
+
+
+def _fits(width, doc, rest):
+    # Whether doc printed flat, then what follows it on the stack up to the
+    # next break, fit in width. Work is bounded by width, not by the size
+    # of the layouts, which keeps rendering linear.
+    stack = [(FLAT, iter((doc,)))]
+    i = len(rest)
+    while width >= 0:
+        if stack:
+            mode, docs = stack[-1]
+            doc = next(docs, _END)
+            if doc is _END:
+                stack.pop()
+                continue
+        elif i:
+            i -= 1
+            _, mode, doc = rest[i]
+        else:
+            return True
+        t = type(doc)
+        if t is list:
+            stack.append((mode, iter(doc)))
+        elif t is Group or t is Nest:
+            stack.append((mode, iter((doc.doc,))))
+        elif t is Line:
+            if mode == BREAK:
+                return True
+            width -= len(doc.flat)
+        elif t is IfBroken:
+            if mode == BREAK:
+                width -= len(doc.text)
+        else:
+            width -= len(doc)
+    return False
+
+
+def render(doc, write, width, column=0, indent=0):
+    """Write a layout, breaking the groups that do not fit in width.
+
+    A layout is text, a list of layouts, a Group, a Nest, a Line or an
+    IfBroken. Each
+    group is decided once, left to right, as in Oppen's and Wadler's
+    pretty printers: there is no backtracking.
+    """
+    stack = [(indent, BREAK, doc)]
+    while stack:
+        indent, mode, doc = stack.pop()
+        t = type(doc)
+        if t is list:
+            stack.extend((indent, mode, d) for d in reversed(doc))
+        elif t is Group:
+            if mode == BREAK and not _fits(width - column, doc.doc, stack):
+                stack.append((indent, BREAK, doc.doc))
+            else:
+                stack.append((indent, FLAT, doc.doc))
+        elif t is Nest:
+            stack.append((indent + doc.indent, mode, doc.doc))
+        elif t is Line:
+            if mode == FLAT:
+                write(doc.flat)
+                column += len(doc.flat)
+            else:
+                write('\n')
+                write(' ' * indent)
+                column = indent
+        elif t is IfBroken:
+            if mode == BREAK:
+                write(doc.text)
+                column += len(doc.text)
+        else:
+            write(doc)
+            column += len(doc)
+    return column
+
+
+def join(separator, docs):
+    result = []
+    for i, doc in enumerate(docs):
+        if i:
+            result.append(separator)
+        result.append(doc)
+    return result
+
+
+# Binding strength of expressions, from the loosest to the tightest.
+PRECEDENCE = {
+    ast.Yield: 0,
+    ast.Lambda: 1,
+    ast.IfExp: 2,
+    ast.Or: 3,
+    ast.And: 4,
+    ast.Not: 5,
+    ast.Compare: 6,
+    ast.BitOr: 7,
+    ast.BitXor: 8,
+    ast.BitAnd: 9,
+    ast.LShift: 10,
+    ast.RShift: 10,
+    ast.Add: 11,
+    ast.Sub: 11,
+    ast.Mult: 12,
+    ast.Div: 12,
+    ast.FloorDiv: 12,
+    ast.Mod: 12,
+    ast.UAdd: 13,
+    ast.USub: 13,
+    ast.Invert: 13,
+    ast.Pow: 14,
+}
+ATOM = 16
+
+OPERATORS = {
+    ast.Add: '+',
+    ast.And: 'and',
+    ast.BitAnd: '&',
+    ast.BitOr: '|',
+    ast.BitXor: '^',
+    ast.Div: '/',
+    ast.Eq: '==',
+    ast.FloorDiv: '//',
+    ast.Gt: '>',
+    ast.GtE: '>=',
+    ast.In: 'in',
+    ast.Invert: '~',
+    ast.Is: 'is',
+    ast.IsNot: 'is not',
+    ast.LShift: '<<',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Mod: '%',
+    ast.Mult: '*',
+    ast.Not: 'not',
+    ast.NotEq: '!=',
+    ast.NotIn: 'not in',
+    ast.Or: 'or',
+    ast.Pow: '**',
+    ast.RShift: '>>',
+    ast.Sub: '-',
+    ast.UAdd: '+',
+    ast.USub: '-',
+}
+
+
+def precedence(node):
+    t = type(node)
+    if t is ast.BinOp or t is ast.BoolOp or t is ast.UnaryOp:
+        return PRECEDENCE[type(node.op)]
+    if t is ast.Num and repr(node.n).startswith('-'):
+        # Python 2 folds '-1' into a negative literal.
+        return PRECEDENCE[ast.USub]
+    return PRECEDENCE.get(t, ATOM)
+
+
+def _imports_unicode_literals(node):
+    return (isinstance(node, ast.ImportFrom) and node.module == '__future__'
+        and any(alias.name == 'unicode_literals' for alias in node.names))
+
+
+# A backslash escape in the repr() of a string.
+_ESCAPE = re.compile(r'\\(.)')
+
+
+def _unescape_triple_quoted(match):
+    # Newlines and single quotes need no escape between triple quotes.
+    char = match.group(1)
+    if char == 'n':
+        return '\n'
+    if char == "'":
+        return char
+    return match.group(0)
+
+
+class Emitter(object):
+    """Write the source of an AST to a file-like object.
+
+    Text is buffered up to the end of each top-level statement, so that a
+    statement the emitter cannot write is undone and copied verbatim from
+    the source instead. An emitter holds no global state: any number of
+    them may run in one process. When stats is a Counter, it counts the
+    nodes of each type written, and those copied verbatim.
+    """
+
+    def __init__(self, out, index=None, width=79, stats=None):
+        self.out = out
+        self._buffer = []
+        self.write = self._buffer.append
+        self.index = index if index is not None else SourceIndex()
+        self.width = width
+        self.stats = stats
+        self.unicode_literals = False
+        self._brackets = 0
+
+    def flush(self):
+        write = self.out.write
+        for text in self._buffer:
+            write(text)
+        del self._buffer[:]
+
+    def dispatch(self, node, indent, ext=None):
+        handler = self.handlers.get(type(node))
+        if handler is None:
+            raise Unsupported(type(node).__name__)
+        if self.stats is not None:
+            self.stats[type(node).__name__] += 1
+        handler(self, node, indent, ext)
+
+    def _verbatim(self, node, indent):
+        # Copy the source of a statement, moved to the current indentation.
+        index = self.index
+        first, last = _span(node, index)
+        lines = index.source(first, last)
+        if not lines:
+            raise Unsupported(type(node).__name__)
+        text = lines[0].lstrip()
+        margin = len(lines[0]) - len(text)
+        if node.col_offset > margin or (not isinstance(node, COMPOUND_STATEMENTS)
+                and index.semicolon_lines.intersection(range(first, last + 1))):
+            # Its lines hold other statements: the enclosing one is copied.
+            raise Unsupported(type(node).__name__)
+        self.write(text)
+        for row, line in enumerate(lines[1:], first + 1):
+            if row in index.string_lines or not line.strip():
+                self.write(line)
+            else:
+                self.write('    ' * indent)
+                self.write(line[min(margin, len(line) - len(line.lstrip())):])
+        if self._buffer[-1].endswith(b'\n'):
+            self._buffer[-1] = self._buffer[-1].rstrip(b'\r\n')
+        # Its comments were copied along.
+        for _ in index.pop_until(last):
+            pass
+        if self.stats is not None:
+            self.stats[type(node).__name__ + ' (verbatim)'] += 1
+
+    def _statement(self, node, indent):
+        # Comments above a statement go on their own lines.
+        compound = isinstance(node, COMPOUND_STATEMENTS)
+        for text in self.index.pop_until(node.lineno - (not compound)):
+            self.write('    ' * indent)
+            self.write(text)
+            self.write('\n')
+        self.write('    ' * indent)
+        mark = len(self._buffer)
+        try:
+            self.dispatch(node, indent)
+        except Unsupported:
+            del self._buffer[mark:]
+            self._verbatim(node, indent)
+            return
+        if not compound:
+            # The last comment within a simple statement stays at its end,
+            # any other goes on its own line before the next statement.
+            comments = self.index.comments
+            last = self.index.logical_lines.get(node.lineno, (None, node.lineno))[1]
+            inner = []
+            while comments and comments[0][0] <= last:
+                inner.append(comments.popleft())
+            if inner:
+                self.write('  ')
+                self.write(inner.pop()[1])
+                comments.extendleft(reversed(inner))
+
+    def _blank_lines_before(self, node, limit):
+        # Blank lines among those, blank or comments only, above the node.
+        blank_lines, comment_lines = self.index.blank_lines, self.index.comment_lines
+        lineno = node.lineno - 1
+        count = 0
+        while lineno in blank_lines or lineno in comment_lines:
+            count += lineno in blank_lines
+            lineno -= 1
+        return min(count, limit)
+
+    def _block(self, nodes, indent):
+        for i, node in enumerate(nodes):
+            if i:
+                self.write('\n')
+                self.write('\n' * self._blank_lines_before(node, 2 if indent == 0 else 1))
+            self._statement(node, indent)
+
+    def _orelse(self, nodes, indent):
+        if nodes:
+            self.write('\n')
+            self.write('    ' * indent)
+            self.write('else:')
+            self.write('\n')
+            self._block(nodes, indent + 1)
+
+    def emit_statements(self, nodes, indent=0):
+        """Write a list of sibling statements and the comments among them."""
+        self._block(nodes, indent)
+        for text in self.index.pop_all():
+            self.write('\n')
+            self.write('    ' * indent)
+            self.write(text)
+        self.flush()
+
+    def emit_module(self, root):
+        # A docstring may come before the import changing its literal.
+        self.unicode_literals = any(_imports_unicode_literals(node) for node in root.body)
+        self.emit_chunks([(root.body, self.index)])
+
+    def emit_chunks(self, chunks):
+        """Write a module given as (top-level statements, SourceIndex) chunks.
+
+        Nothing is kept from a chunk once it is written, so chunks may be
+        parsed one at a time as they are consumed.
+        """
+        write = self.write
+        prev = None
+        for nodes, index in chunks:
+            if index is not self.index:
+                # Comments left over, at the end of a block, go with what follows.
+                index.comments.extendleft(reversed(self.index.comments))
+                self.index = index
+            for node in nodes:
+                # Nothing goes before the first line: it may be a shebang,
+                # and the coding cookie must stay within the first two.
+                if prev is not None:
+                    line_count = 0
+                    if prev in (ast.FunctionDef, ast.ClassDef):
+                        line_count = 2
+                    elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                        line_count = 2
+                    elif prev in (ast.Import, ast.ImportFrom) and not isinstance(node, (ast.Import, ast.ImportFrom)):
+                        line_count = 2
+                    elif prev != type(node):
+                        line_count = 1
+                    comments = self.index.comments
+                    if comments and comments[0][0] <= 2:
+                        # Such as a coding cookie after a docstring.
+                        line_count = 0
+                    write('\n' * (line_count + 1))
+                self._statement(node, indent=0)
+                self.flush()
+                prev = type(node)
+        for text in self.index.pop_all():
+            if prev is not None:
+                write('\n')
+            write(text)
+            prev = True
+        if prev is not None:
+            # Ends the last line.
+            write('\n')
+        self.flush()
+
+    def _render(self, doc, indent):
+        render(doc, self.write, self.width, 4 * indent, 4 * indent)
+
+    def _sep(self):
+        # Operators may only be followed by a line break within brackets.
+        return LINE if self._brackets else ' '
+
+    def _wrap(self, open, items, close):
+        if not items:
+            return [open, close]
+        return Group([open, Nest(4, [SOFTLINE, join([',', LINE], items)]), SOFTLINE, close])
+
+    def _items(self, nodes, prec=1):
+        self._brackets += 1
+        items = [self.doc(node, prec) for node in nodes]
+        self._brackets -= 1
+        return items
+
+    def _clause(self, node):
+        # An operation making up a whole clause may be broken over several
+        # lines within parentheses added for the purpose.
+        if precedence(node) == ATOM:
+            return self._target(node)
+        self._brackets += 1
+        doc = self.doc(node)
+        self._brackets -= 1
+        return Group([IfBroken('('), Nest(4, [SOFTLINE, doc]), SOFTLINE, IfBroken(')')])
+
+    def _target(self, node):
+        # Tuples need no parentheses as whole targets or values, but to be
+        # broken over several lines.
+        if isinstance(node, ast.Tuple) and len(node.elts) > 1:
+            return self._wrap(IfBroken('('), self._items(node.elts), IfBroken(')'))
+        return self.doc(node)
+
+    def doc(self, node, prec=0):
+        """Layout of an expression, in parentheses if it binds looser than prec."""
+        if precedence(node) < prec:
+            self._brackets += 1
+            doc = self.doc(node)
+            self._brackets -= 1
+            return Group(['(', Nest(4, [SOFTLINE, doc]), SOFTLINE, ')'])
+        handler = self.doc_handlers.get(type(node))
+        if handler is None:
+            raise Unsupported(type(node).__name__)
+        if self.stats is not None:
+            self.stats[type(node).__name__] += 1
+        return handler(self, node)
+
+    def doc_alias(self, node):
+        if node.asname is None:
+            return node.name
+        return [node.name, ' as ', node.asname]
+
+    def doc_arguments(self, node):
+        items = []
+        no_default_arg_count = len(node.args) - len(node.defaults)
+        self._brackets += 1
+        for i, subnode in enumerate(node.args, - no_default_arg_count):
+            if i >= 0:
+                items.append([self.doc(subnode), '=', self.doc(node.defaults[i], 1)])
+            else:
+                items.append(self.doc(subnode))
+        self._brackets -= 1
+        if node.vararg is not None:
+            items.append(['*', node.vararg])
+        if node.kwarg is not None:
+            items.append(['**', node.kwarg])
+        return items
+
+    def doc_keyword(self, node):
+        return [node.arg, '=', self.doc(node.value, 1)]
+
+    def doc_comprehension(self, node):
+        # In comprehensions, 'in' and 'if' take no conditional expression.
+        doc = ['for ', self._target(node.target), ' in ', self.doc(node.iter, 3)]
         for subnode in node.ifs:
-            dispatch(subnode, indent)
-
-
-def format_Tuple(node, indent, ext=None):
-    if not isinstance(node.ctx, ast.Store):
-        chunks.append('(')
-    for subnode in node.elts:
-        dispatch(subnode, indent)
-        chunks.append(', ')
-    if node.elts:
-        chunks.pop()
-    if not isinstance(node.ctx, ast.Store):
-        chunks.append(')')
-
-
-def format_keyword(node, indent, ext=None):
-    dispatch(node.arg, indent)
-    chunks.append('=')
-    dispatch(node.value, indent)
-
-
-def format_Index(node, indent, ext=None):
-    dispatch(node.value, indent)
-
-
-def format_UnaryOp(node, indent, ext=None):
-    dispatch(node.op, indent)
-    chunks.append(' ')
-    dispatch(node.operand, indent)
-
-
-def format_Pass(node, indent, ext=None):
-    chunks.append('pass')
-
-
-def format_BoolOp(node, indent, ext=None):
-    for i, subnode in enumerate(node.values):
-        dispatch(subnode, indent)
-        if i + 1 < len(node.values):
-            dispatch(node.op, indent)
-
-
-def format_BinOp(node, indent, ext=None):
-    dispatch(node.left, indent)
-    chunks.append(' ')
-    dispatch(node.op, indent)
-    chunks.append(' ')
-    dispatch(node.right, indent)
-
-
-def format_Assign(node, indent, ext=None):
-    for subnode in node.targets:
-        dispatch(subnode, indent)
-        chunks.append(', ')
-    if node.targets:
-        chunks.pop()
-    chunks.append(' = ')
-    dispatch(node.value, indent)
-
-
-def format_List(node, indent, ext=None):
-    chunks.append('[')
-    for subnode in node.elts:
-        dispatch(subnode, indent)
-        token.append(', ')
-    if node.elts:
-        token.pop()
-    chunks.append(']')
-
-
-funcmap = {k: v for k, v in locals().items() if callable(v)}
-
-
-def dispatch(node, indent, ext=None):
-    typename = type(node).__name__
-    funcname = 'format_{}'.format(typename)
-    if funcname in funcmap:
-        func = funcmap[funcname]
-        func(node, indent, ext)
-    else:
-        chunks.append(' <{}> '.format(type(node).__name__))
+            doc.extend([LINE, 'if ', self.doc(subnode, 3)])
+        return doc
+
+    def _comprehension(self, open, elt, generators, close):
+        self._brackets += 1
+        doc = list(elt)
+        for subnode in generators:
+            doc.extend([LINE, self.doc(subnode)])
+        self._brackets -= 1
+        return Group([open, Nest(4, [SOFTLINE, doc]), SOFTLINE, close])
+
+    def doc_Name(self, node):
+        return node.id
+
+    def doc_Num(self, node):
+        n = node.n
+        if isinstance(n, complex):
+            # Literals only make imaginary numbers, repr() shows real parts.
+            text = repr(n.imag) + 'j'
+        else:
+            text = repr(n)
+        # Literals overflowing floats read as infinity.
+        return text.replace('inf', '1e999')
+
+    def doc_Str(self, node, docstring=False):
+        s = node.s
+        text = repr(s)
+        if isinstance(s, unicode):
+            if self.unicode_literals:
+                text = text[1:]
+        elif self.unicode_literals:
+            text = 'b' + text
+        newline, quote = (b'\n', b'"') if isinstance(s, bytes) else ('\n', '"')
+        # Tokens spanning lines, such as triple-quoted strings, have no
+        # column.
+        multi_line = node.col_offset < 0 and newline in s
+        if (docstring or multi_line) and quote * 3 not in s and not s.endswith(quote):
+            # Docstrings and multi-line strings keep their lines.
+            prefix, body = text[:text.index(text[-1])], text[text.index(text[-1]) + 1:-1]
+            body = _ESCAPE.sub(_unescape_triple_quoted, body)
+            return [prefix, '"""', body, '"""']
+        return text
+
+    def doc_Ellipsis(self, node):
+        return '...'
+
+    def doc_Repr(self, node):
+        return ['`', self._target(node.value), '`']
+
+    def doc_Lambda(self, node):
+        self._brackets += 1
+        args = self.doc(node.args)
+        self._brackets -= 1
+        if not args:
+            return ['lambda: ', self.doc(node.body, 1)]
+        return ['lambda ', join(', ', args), ': ', self.doc(node.body, 1)]
+
+    def doc_Yield(self, node):
+        if node.value is None:
+            return 'yield'
+        return ['yield ', self._target(node.value)]
+
+    def doc_Attribute(self, node):
+        # '1.real' would read as a float literal.
+        prec = ATOM + 1 if isinstance(node.value, ast.Num) else ATOM
+        return [self.doc(node.value, prec), '.', node.attr]
+
+    def doc_Call(self, node):
+        items = self._items(node.args)
+        self._brackets += 1
+        items.extend(self.doc(subnode) for subnode in node.keywords)
+        if node.starargs is not None:
+            items.append(['*', self.doc(node.starargs, 1)])
+        if node.kwargs is not None:
+            items.append(['**', self.doc(node.kwargs, 1)])
+        self._brackets -= 1
+        if len(items) == 1 and isinstance(node.args[0] if node.args else None, ast.GeneratorExp):
+            # A lone generator argument needs no parentheses of its own.
+            generator = node.args[0]
+            self._brackets += 1
+            elt = self.doc(generator.elt, 1)
+            self._brackets -= 1
+            return [
+                self.doc(node.func, ATOM),
+                self._comprehension('(', [elt], generator.generators, ')'),
+            ]
+        return [self.doc(node.func, ATOM), self._wrap('(', items, ')')]
+
+    def doc_Subscript(self, node):
+        return [self.doc(node.value, ATOM), self._wrap('[', self._items([node.slice], 0), ']')]
+
+    def doc_Index(self, node):
+        # Within brackets already, tuples break along with them.
+        if isinstance(node.value, ast.Tuple) and len(node.value.elts) > 1:
+            return join([',', LINE], self._items(node.value.elts))
+        return self.doc(node.value)
+
+    def doc_Slice(self, node):
+        doc = []
+        if node.lower is not None:
+            doc.append(self.doc(node.lower, 1))
+        doc.append(':')
+        if node.upper is not None:
+            doc.append(self.doc(node.upper, 1))
+        if node.step is not None:
+            doc.extend([':', self.doc(node.step, 1)])
+        return doc
+
+    def doc_ExtSlice(self, node):
+        docs = join(', ', [self.doc(dim) for dim in node.dims])
+        return docs + [','] if len(node.dims) == 1 else docs
+
+    def doc_Tuple(self, node):
+        items = self._items(node.elts)
+        if len(items) == 1:
+            return ['(', items[0], ',)']
+        return self._wrap('(', items, ')')
+
+    def doc_List(self, node):
+        return self._wrap('[', self._items(node.elts), ']')
+
+    def doc_Dict(self, node):
+        self._brackets += 1
+        items = [
+            [self.doc(key, 1), ': ', self.doc(value, 1)]
+            for key, value in zip(node.keys, node.values)
+        ]
+        self._brackets -= 1
+        return self._wrap('{', items, '}')
+
+    def doc_Set(self, node):
+        return self._wrap('{', self._items(node.elts), '}')
+
+    def doc_ListComp(self, node):
+        self._brackets += 1
+        elt = self.doc(node.elt, 1)
+        self._brackets -= 1
+        return self._comprehension('[', [elt], node.generators, ']')
+
+    def doc_SetComp(self, node):
+        self._brackets += 1
+        elt = self.doc(node.elt, 1)
+        self._brackets -= 1
+        return self._comprehension('{', [elt], node.generators, '}')
+
+    def doc_GeneratorExp(self, node):
+        self._brackets += 1
+        elt = self.doc(node.elt, 1)
+        self._brackets -= 1
+        return self._comprehension('(', [elt], node.generators, ')')
+
+    def doc_DictComp(self, node):
+        self._brackets += 1
+        elt = [self.doc(node.key, 1), ': ', self.doc(node.value, 1)]
+        self._brackets -= 1
+        return self._comprehension('{', elt, node.generators, '}')
+
+    def doc_IfExp(self, node):
+        sep = self._sep()
+        return Group([
+            self.doc(node.body, 3), sep, 'if ', self.doc(node.test, 3),
+            sep, 'else ', self.doc(node.orelse, 2),
+        ])
+
+    def doc_BoolOp(self, node):
+        prec = precedence(node) + 1
+        operator = OPERATORS[type(node.op)] + ' '
+        doc = []
+        for i, subnode in enumerate(node.values):
+            if i:
+                doc.extend([self._sep(), operator])
+            doc.append(self.doc(subnode, prec))
+        return Group(doc)
+
+    def doc_BinOp(self, node):
+        prec = precedence(node)
+        if isinstance(node.op, ast.Pow):
+            # Right associative, and its right operand may be unary.
+            left, right = self.doc(node.left, prec + 1), self.doc(node.right, PRECEDENCE[ast.USub])
+        else:
+            left, right = self.doc(node.left, prec), self.doc(node.right, prec + 1)
+        return Group([left, self._sep(), OPERATORS[type(node.op)], ' ', right])
+
+    def doc_Compare(self, node):
+        prec = PRECEDENCE[ast.Compare] + 1
+        doc = [self.doc(node.left, prec)]
+        for op, comparator in zip(node.ops, node.comparators):
+            doc.extend([self._sep(), OPERATORS[type(op)], ' ', self.doc(comparator, prec)])
+        return Group(doc)
+
+    def doc_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            return ['not ', self.doc(node.operand, PRECEDENCE[ast.Not])]
+        prec = PRECEDENCE[type(node.op)]
+        if isinstance(node.operand, ast.Num) and isinstance(node.op, ast.USub):
+            # '-1' would be folded into a negative literal.
+            prec = ATOM + 1
+        return [OPERATORS[type(node.op)], self.doc(node.operand, prec)]
+
+    def format_Expr(self, node, indent, ext=None):
+        if isinstance(node.value, ast.Str):
+            self._render(self.doc_Str(node.value, docstring=True), indent)
+        else:
+            self._render(self._clause(node.value), indent)
+
+    def format_Assign(self, node, indent, ext=None):
+        doc = []
+        for subnode in node.targets:
+            doc.extend([self._target(subnode), ' = '])
+        doc.append(self._clause(node.value))
+        self._render(doc, indent)
+
+    def format_AugAssign(self, node, indent, ext=None):
+        self._render([
+            self.doc(node.target), ' ', OPERATORS[type(node.op)], '= ',
+            self._clause(node.value),
+        ], indent)
+
+    def format_Raise(self, node, indent, ext=None):
+        doc = ['raise']
+        for i, subnode in enumerate((node.type, node.inst, node.tback)):
+            if subnode is None:
+                break
+            doc.extend([', ' if i else ' ', self.doc(subnode, 1)])
+        self._render(doc, indent)
+
+    def format_Return(self, node, indent, ext=None):
+        if node.value is None:
+            self.write('return')
+        else:
+            self._render(['return ', self._clause(node.value)], indent)
+
+    def format_Delete(self, node, indent, ext=None):
+        self._render(['del ', join(', ', [self.doc(n, 1) for n in node.targets])], indent)
+
+    def format_Print(self, node, indent, ext=None):
+        items = [self.doc(value, 1) for value in node.values]
+        if node.dest is not None:
+            items.insert(0, ['>>', self.doc(node.dest, 1)])
+        doc = ['print']
+        if items:
+            doc.extend([' ', join(', ', items)])
+            if not node.nl:
+                doc.append(',')
+        self._render(doc, indent)
+
+    def format_Global(self, node, indent, ext=None):
+        self.write('global ')
+        self.write(', '.join(node.names))
+
+    def format_Exec(self, node, indent, ext=None):
+        doc = ['exec ', self.doc(node.body, PRECEDENCE[ast.BitOr])]
+        if node.globals is not None:
+            doc.extend([' in ', self.doc(node.globals, 1)])
+            if node.locals is not None:
+                doc.extend([', ', self.doc(node.locals, 1)])
+        self._render(doc, indent)
+
+    def format_Assert(self, node, indent, ext=None):
+        doc = ['assert ', self.doc(node.test, 1)]
+        if node.msg is not None:
+            doc.extend([', ', self.doc(node.msg, 1)])
+        self._render(doc, indent)
+
+    def format_Pass(self, node, indent, ext=None):
+        self.write('pass')
+
+    def format_Break(self, node, indent, ext=None):
+        self.write('break')
+
+    def format_Continue(self, node, indent, ext=None):
+        self.write('continue')
+
+    def format_Import(self, node, indent, ext=None):
+        self._render(['import ', join(', ', [self.doc(n) for n in node.names])], indent)
+
+    def format_ImportFrom(self, node, indent, ext=None):
+        if _imports_unicode_literals(node):
+            self.unicode_literals = True
+        names = [self.doc(n) for n in node.names]
+        if node.names[0].name != '*':
+            # Only the names of from imports may be within parentheses.
+            names = self._wrap(IfBroken('('), names, IfBroken(')'))
+        self._render([
+            'from ', '.' * (node.level or 0), node.module or '', ' import ', names,
+        ], indent)
+
+    def _decorated(self, node, header, indent):
+        decorators = [['@', self.doc(subnode)] for subnode in node.decorator_list]
+        for doc in decorators:
+            self._render(doc, indent)
+            self.write('\n')
+            self.write('    ' * indent)
+        self._render(header, indent)
+        self.write('\n')
+        self._block(node.body, indent + 1)
+
+    def format_FunctionDef(self, node, indent, ext=None):
+        header = ['def ', node.name, self._wrap('(', self.doc(node.args), ')'), ':']
+        self._decorated(node, header, indent)
+
+    def format_ClassDef(self, node, indent, ext=None):
+        header = ['class ', node.name]
+        if node.bases:
+            header.append(self._wrap('(', self._items(node.bases), ')'))
+        header.append(':')
+        self._decorated(node, header, indent)
+
+    def format_TryExcept(self, node, indent, ext=None):
+        if ext != 'finally':
+            self.write('try:')
+            self.write('\n')
+            self._block(node.body, indent + 1)
+        for handler in node.handlers:
+            doc = ['except']
+            if handler.type is not None:
+                doc.extend([' ', self.doc(handler.type, 1)])
+                if handler.name is not None:
+                    doc.extend([' as ', self.doc(handler.name, 1)])
+            doc.append(':')
+            self.write('\n')
+            self.write('    ' * indent)
+            self._render(doc, indent)
+            self.write('\n')
+            self._block(handler.body, indent + 1)
+        self._orelse(node.orelse, indent)
+
+    def format_TryFinally(self, node, indent, ext=None):
+        self.write('try:')
+        self.write('\n')
+        body = node.body
+        if len(body) == 1 and isinstance(body[0], ast.TryExcept) and body[0].lineno == node.lineno:
+            # try/except/finally, parsed as a try/except in a try/finally.
+            self._block(body[0].body, indent + 1)
+            self.dispatch(body[0], indent, ext='finally')
+        else:
+            self._block(body, indent + 1)
+        self.write('\n')
+        self.write('    ' * indent)
+        self.write('finally:')
+        self.write('\n')
+        self._block(node.finalbody, indent + 1)
+
+    def format_While(self, node, indent, ext=None):
+        self._render(['while ', self._clause(node.test), ':'], indent)
+        self.write('\n')
+        self._block(node.body, indent + 1)
+        self._orelse(node.orelse, indent)
+
+    def format_For(self, node, indent, ext=None):
+        self._render([
+            'for ', self._target(node.target), ' in ', self._clause(node.iter), ':',
+        ], indent)
+        self.write('\n')
+        self._block(node.body, indent + 1)
+        self._orelse(node.orelse, indent)
+
+    def format_With(self, node, indent, ext=None):
+        doc = ['with ']
+        while True:
+            doc.append(self.doc(node.context_expr, 1))
+            if node.optional_vars:
+                doc.extend([' as ', self.doc(node.optional_vars)])
+            body = node.body
+            if not (len(body) == 1 and isinstance(body[0], ast.With) and body[0].lineno == node.lineno):
+                break
+            # with a, b: parsed as a with statement in another.
+            node = body[0]
+            doc.append(', ')
+        doc.append(':')
+        self._render(doc, indent)
+        self.write('\n')
+        self._block(body, indent + 1)
+
+    def format_If(self, node, indent, ext=None):
+        self._render(['elif ' if ext == 'elif' else 'if ', self._clause(node.test), ':'], indent)
+        self.write('\n')
+        self._block(node.body, indent + 1)
+        if len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If):
+            self.write('\n')
+            self.write('    ' * indent)
+            self.dispatch(node.orelse[0], indent, ext='elif')
+        else:
+            self._orelse(node.orelse, indent)
+
+
+def _build_handlers(cls, prefix):
+    # Resolve every <prefix><Type> method to its type once, so that
+    # dispatching a node is a single dict lookup on type(node).
+    handlers = {}
+    for name, func in vars(cls).items():
+        if name.startswith(prefix):
+            handlers[getattr(ast, name[len(prefix):])] = func
+    return handlers
+
+
+Emitter.handlers = _build_handlers(Emitter, 'format_')
+Emitter.doc_handlers = _build_handlers(Emitter, 'doc_')
+
+
+class EncodedWriter(object):
+    """Write to a byte stream, encoding unicode text on the way."""
+
+    def __init__(self, stream, encoding='utf-8'):
+        self.stream = stream
+        self.encoding = encoding
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode(self.encoding)
+        self.stream.write(text)
+
+
+def format_file(content, out, width=79, stats=None):
+    root = ast.parse(content)
+    lines = StringIO.StringIO(content).readlines()
+    index = SourceIndex(tokenize.generate_tokens(iter(lines).next), lines=lines)
+    Emitter(out, index, width, stats).emit_module(root)
+
+
+# Keywords going on with the compound statement of the previous line.
+_CONTINUATIONS = frozenset([b'elif', b'else', b'except', b'finally'])
+
+_CODING = re.compile(br'^[ \t\f]*#.*coding[:=][ \t]*([-\w.]+)')
+
+
+def _parse_chunk(lines, start, flags, coding):
+    # Parse lines starting at line start of a source as if in place.
+    offset = start - 1
+    source = b''.join(lines)
+    if coding is not None and start > 2:
+        source = b'# -*- coding: ' + coding + b' -*-\n' + source
+        offset -= 1
+    try:
+        root = compile(source, '<unknown>', 'exec', flags, True)
+    except SyntaxError as e:
+        if e.lineno is not None:
+            e.lineno += offset
+        raise
+    ast.increment_lineno(root, offset)
+    return root.body
+
+
+def iter_chunks(readline):
+    """Parse a source one top-level statement at a time.
+
+    Yield (statements, SourceIndex) chunks as the source is read, so that
+    only the lines, tokens and tree of one statement are held at once.
+    Comments and blank lines go with the statement following them.
+    """
+    lines = []
+
+    def read():
+        line = readline()
+        lines.append(line)
+        return line
+
+    tokens = []
+    start = 1
+    flags = ast.PyCF_ONLY_AST
+    coding = None
+    depth = 0
+    split = None
+    at_line_start, decorator = True, False
+    for token in tokenize.generate_tokens(read):
+        tok_type, text, (row, _), _, _ = token
+        if tok_type == tokenize.INDENT:
+            depth += 1
+        elif tok_type == tokenize.DEDENT:
+            depth -= 1
+        elif tok_type == tokenize.NEWLINE:
+            at_line_start = True
+            split = len(tokens) + 1, row
+        elif tok_type in (tokenize.COMMENT, tokenize.NL, tokenize.ENDMARKER):
+            if coding is None and row <= 2 and tok_type == tokenize.COMMENT:
+                match = _CODING.match(text)
+                coding = match and match.group(1)
+        elif at_line_start:
+            at_line_start = False
+            if depth == 0 and split is not None and not decorator and text not in _CONTINUATIONS:
+                i, end = split
+                chunk_lines, lines[:end - start + 1] = lines[:end - start + 1], []
+                nodes = _parse_chunk(chunk_lines, start, flags, coding)
+                for node in nodes:
+                    if isinstance(node, ast.ImportFrom) and node.module == '__future__':
+                        for alias in node.names:
+                            feature = getattr(__future__, alias.name, None)
+                            if feature is not None:
+                                flags |= feature.compiler_flag
+                chunk_tokens, tokens[:i] = tokens[:i], []
+                yield nodes, SourceIndex(chunk_tokens, lines=chunk_lines, first_line=start)
+                del nodes, chunk_tokens, chunk_lines
+                start = end + 1
+            decorator = depth == 0 and text == b'@'
+        tokens.append(token)
+    yield _parse_chunk(lines, start, flags, coding), SourceIndex(tokens, lines=lines, first_line=start)
+
+
+def format_stream(readline, out, width=79, stats=None):
+    """Format a source read line by line, holding one statement at a time."""
+    Emitter(out, width=width, stats=stats).emit_chunks(iter_chunks(readline))
+
+
+def format_source(content, width=79, stats=None):
+    out = io.BytesIO()
+    format_file(content, EncodedWriter(out), width, stats)
+    return out.getvalue()
+
+
+_BLOCK_FIELDS = ('body', 'handlers', 'orelse', 'finalbody')
+
+
+def _blocks(node):
+    """Statement lists nested in a statement, in source order."""
+    for field in _BLOCK_FIELDS:
+        nodes = getattr(node, field, None)
+        # Exec.body is an expression.
+        if not nodes or not isinstance(nodes, list):
+            continue
+        if field == 'handlers':
+            for handler in nodes:
+                yield handler.body
+        else:
+            yield nodes
+
+
+def _span(node, index):
+    first, last = index.logical_lines[node.lineno]
+    for block in _blocks(node):
+        last = _span(block[-1], index)[1]
+    return first, last
+
+
+def _select(block, first, last, index):
+    """Smallest run of statements enclosing lines first to last.
+
+    Return (block, i, j) so that block[i:j] is the run, or None
+    when no statement of block overlaps the lines.
+    """
+    spans = [_span(node, index) for node in block]
+    overlapping = [i for i, (start, end) in enumerate(spans) if start <= last and first <= end]
+    if not overlapping:
+        return None
+    i, j = overlapping[0], overlapping[-1] + 1
+    if j - i == 1:
+        node = block[i]
+        for subblock in _blocks(node):
+            start = _span(subblock[0], index)[0]
+            end = _span(subblock[-1], index)[1]
+            if start <= first and last <= end:
+                if _follows_header(node, subblock[0], index):
+                    # Splicing its line back would lose the header.
+                    break
+                selection = _select(subblock, first, last, index)
+                if selection is None or (selection[0] is subblock and _is_elif(node, subblock)):
+                    # An elif is only written along with its if.
+                    break
+                return selection
+    return block, i, j
+
+
+# Start of a clause header.
+_HEADER = re.compile(br'(?:class|def|elif|else|except|finally|for|if|try|while|with)\b')
+
+
+def _follows_header(parent, node, index):
+    # Whether node shares the header of its block. Only simple statements
+    # can, and those never start with a keyword, but for the with items
+    # after the first, which the tree nests.
+    first = index.logical_lines[node.lineno][0]
+    if first == index.logical_lines[parent.lineno][0]:
+        return True
+    if isinstance(node, COMPOUND_STATEMENTS):
+        return False
+    return _HEADER.match(index.source(first, first)[0].lstrip()) is not None
+
+
+def _is_elif(node, block):
+    return isinstance(node, ast.If) and block is node.orelse and len(block) == 1 and isinstance(
+        block[0], ast.If)
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def _uncertain_start(node):
+    # Python 2 reports the last line of a multi-line string expression.
+    return isinstance(node, ast.Expr) and node.col_offset < 0
+
+
+def format_ranges(content, ranges, width=79):
+    """Format only the statements touched by the given line ranges.
+
+    Ranges are (first, last) line numbers, both included. Each one is
+    mapped to the smallest run of sibling statements enclosing it, and
+    only those are formatted and spliced back into the source. Only the
+    top-level statements around the ranges are tokenized, so the cost
+    follows the size of the edits rather than the size of the source.
+    """
+    root = ast.parse(content)
+    lines = content.splitlines(True)
+    body = root.body
+    starts = [node.lineno for node in body]
+
+    # Top-level statements enclosing each range, as [i, j, ranges] windows.
+    windows = []
+    for first, last in _merge_ranges(ranges):
+        i = max(bisect.bisect_right(starts, first) - 1, 0)
+        # Statements sharing a line are spliced back together.
+        while i > 0 and (starts[i - 1] == starts[i] or _uncertain_start(body[i])):
+            i -= 1
+        j = bisect.bisect_right(starts, last)
+        while j < len(body) and _uncertain_start(body[j]):
+            j += 1
+        if windows and i < windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], j)
+            windows[-1][2].append((first, last))
+        else:
+            windows.append([i, j, [(first, last)]])
+
+    selections = []
+    for i, j, window_ranges in windows:
+        start = 1 if i == 0 else body[i].lineno
+        stop = body[j].lineno if j < len(body) else len(lines) + 1
+        window_lines = lines[start - 1:stop - 1]
+        index = SourceIndex(tokenize.generate_tokens(iter(window_lines).next),
+            offset=start - 1, lines=window_lines)
+        window = []
+        for first, last in window_ranges:
+            selection = _select(body[i:j], first, last, index)
+            if selection is None:
+                continue
+            block, k, l = selection
+            span = _span(block[k], index)[0], _span(block[l - 1], index)[1]
+            for other in window:
+                if other[1] is block and span[0] <= other[0][1] and other[0][0] <= span[1]:
+                    # Overlapping runs of the same block: format their union.
+                    other[2], other[3] = min(other[2], k), max(other[3], l)
+                    other[0] = (min(other[0][0], span[0]), max(other[0][1], span[1]))
+                    break
+            else:
+                window.append([span, block, k, l, index])
+        # A run nested in another one is formatted along with it.
+        window.sort(key=lambda s: (s[0][0], -s[0][1]))
+        for selection in window:
+            if selections and selection[0][1] <= selections[-1][0][1]:
+                continue
+            selections.append(selection)
+
+    unicode_literals = any(_imports_unicode_literals(node) for node in body)
+    for (first, last), block, k, l, index in reversed(selections):
+        indentation = lines[first - 1][:len(lines[first - 1]) - len(lines[first - 1].lstrip())]
+        out = io.BytesIO()
+        # Emitted unindented, the lines get the original indentation back,
+        # but for those within strings.
+        emitter = Emitter(EncodedWriter(out), index.region(first, last), width - len(indentation))
+        emitter.unicode_literals = unicode_literals
+        emitter.emit_statements(block[k:l])
+        text = out.getvalue() + b'\n'
+        string_lines = SourceIndex(tokenize.generate_tokens(io.BytesIO(text).readline)).string_lines
+        lines[first - 1:last] = [
+            indentation + line if line.strip() and row not in string_lines else line
+            for row, line in enumerate(text.splitlines(True), 1)]
+    return b''.join(lines)
+
+
+def print_stats(stats, file=sys.stderr):
+    for name, count in sorted(stats.items(), key=lambda item: (-item[1], item[0])):
+        print('{:10} {}'.format(count, name), file=file)
+
+
+def parse_line_range(text):
+    first, _, last = text.partition('-')
+    return int(first), int(last or first)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('filepath')
+    parser.add_argument('-l', '--lines', type=parse_line_range, action='append', metavar='FIRST-LAST',
+        help='Only format statements touching these lines and print the whole file.')
+    parser.add_argument('-s', '--stream', action='store_true',
+        help='Read and format one top-level statement at a time, for very large files.')
+    parser.add_argument('-w', '--width', type=int, default=79,
+        help='Maximum line length (default: %(default)s).')
+    parser.add_argument('--stats', action='store_true',
+        help='Report how many nodes of each type were written, and copied verbatim.')
     args = parser.parse_args()
 
+    stats = collections.Counter() if args.stats else None
     with open(args.filepath) as f:
-        content = f.read()
-        root = ast.parse(content)
-        tokens = tokenize.generate_tokens(StringIO.StringIO(content).readline)
-
-    comments = [t for t in tokens if t[0] == tokenize.COMMENT]
-
-    prev = None
-    for node in root.body:
-
-        while comments:
-            next_comment_txt = comments[0][1]
-            next_comment_lineno = comments[0][2][0]
-            next_comment_col = comments[0][2][1]
-            if next_comment_lineno > node.lineno:
-                break
-            if prev is not None:
-                chunks.append('\n')
-            chunks.append(' ' * next_comment_col)
-            chunks.append(next_comment_txt)
-            comments.pop(0)
-            prev = tokenize.COMMENT
-
-        line_count = 0
-        if isinstance(prev, ast.FunctionDef):
-            line_count = 2
-        elif isinstance(node, ast.FunctionDef):
-            line_count = 2
-        elif isinstance(prev, (ast.Import, ast.ImportFrom)) and not isinstance(node, (ast.Import, ast.ImportFrom)):
-            line_count = 2
-        elif type(prev) != type(node):
-            line_count = 1
-
-        chunks.append('\n' * (line_count + 1))
-        dispatch(node, indent=0)
-        prev = node
-    chunks.append('\n')
-
-    print(''.join(chunks))
+        if args.stream:
+            format_stream(f.readline, sys.stdout, args.width, stats)
+        elif args.lines:
+            sys.stdout.write(format_ranges(f.read(), args.lines, args.width))
+        else:
+            format_file(f.read(), sys.stdout, args.width, stats)
+    if stats is not None:
+        print_stats(stats)
 
 
 if __name__ == '__main__':
     main()
-
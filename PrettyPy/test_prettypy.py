@@ -0,0 +1,61 @@
+from __future__ import absolute_import, division, print_function
+
+import unittest
+
+import prettypy
+
+
+class FormatSourceTest(unittest.TestCase):
+
+    def test_strings_with_newlines(self):
+        content = b'x = "\\n".join(items)\ny = """a\nb"""\n'
+        self.assertEqual(prettypy.format_source(content), b"x = '\\n'.join(items)\ny = \"\"\"a\nb\"\"\"\n")
+
+
+    def test_coding_cookie_after_docstring(self):
+        content = b'"""Doc."""\n# -*- coding: utf-8 -*-\nimport os\n'
+        self.assertEqual(prettypy.format_source(content), content)
+
+    def test_long_imports_and_tuples(self):
+        names = ', '.join('name{}'.format(i) for i in range(12))
+        content = 'from module import {}\nx = {}\n'.format(names, names).encode()
+        for line in prettypy.format_source(content).splitlines():
+            self.assertLessEqual(len(line), 79)
+
+
+class FormatRangesTest(unittest.TestCase):
+
+    def test_statements_sharing_a_line(self):
+        content = b'x = 0\na = 1; b = 2\n'
+        self.assertEqual(prettypy.format_ranges(content, [(2, 2)]), b'x = 0\na = 1\nb = 2\n')
+
+    def test_exec_statement(self):
+        content = b'exec "x=1" in d\ny=2\n'
+        self.assertEqual(prettypy.format_ranges(content, [(1, 1)]), b"exec 'x=1' in d\ny=2\n")
+
+    def test_one_line_compound_statement(self):
+        content = b'class C(object):\n    def match(self, node): return False\n'
+        self.assertIn(b'def match(self, node):', prettypy.format_ranges(content, [(2, 2)]))
+
+    def test_with_items(self):
+        content = b'with a as b, c as d:\n    x=1\n'
+        self.assertEqual(prettypy.format_ranges(content, [(2, 2)]), b'with a as b, c as d:\n    x = 1\n')
+
+    def test_elif(self):
+        content = b'if a:\n    pass\nelif b:\n    x=1\n    y=2\n'
+        self.assertEqual(prettypy.format_ranges(content, [(3, 4)]),
+            b'if a:\n    pass\nelif b:\n    x = 1\n    y = 2\n')
+
+    def test_multi_line_string(self):
+        content = b'def f():\n    """Doc.\n\nMore.\n    """\n    x=1\n'
+        self.assertEqual(prettypy.format_ranges(content, [(2, 6)]),
+            b'def f():\n    """Doc.\n\nMore.\n    """\n    x = 1\n')
+
+    def test_unicode_literals(self):
+        content = b'from __future__ import unicode_literals\nx=\'a\'\n'
+        self.assertEqual(prettypy.format_ranges(content, [(2, 2)]),
+            b'from __future__ import unicode_literals\nx = \'a\'\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
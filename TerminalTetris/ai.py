@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""Play TerminalTetris by searching the best placement of each sprite.
+
+Every placement of the sprite, a rotation and a column from which it is
+dropped straight down, is scored at once on a stack of boards, with a
+lookahead on the next sprite: the score of a placement is the one of the
+best placement of the next sprite after it.
+"""
+
+import argparse
+import multiprocessing
+import random
+import time
+
+import numpy as np
+
+import simulator
+import tetris
+
+
+# Weights of aggregate height, lines cleared, holes and bumpiness, after
+# Yiyuan Lee's genetic tuning.
+WEIGHTS = (-0.510066, 0.760666, -0.35663, -0.184483)
+
+HEIGHT, WIDTH = tetris.GameArea.shape
+
+
+def _placements(sprite_type):
+    """Return the rotations, columns and absolute cells of every placement.
+
+    Rotations that look the same once shifted, as all of OSprite's, are
+    only tried once. Along with those comes the list of every (rotation,
+    column) giving the same cells as each placement.
+    """
+    rotations, columns, cells, equivalents, seen = [], [], [], [], {}
+    for rotation, shape in enumerate(sprite_type.rotations):
+        rows = [r for r, c in shape.cells]
+        cols = [c for r, c in shape.cells]
+        key = frozenset((r - min(rows), c - min(cols)) for r, c in shape.cells)
+        if key in seen:
+            # The same cells, from a column shifted by the difference of
+            # the leftmost columns of both rotations.
+            first, left = seen[key]
+            for i in range(len(rotations)):
+                if rotations[i] == first:
+                    equivalents[i].append((rotation, columns[i] + left - min(cols)))
+            continue
+        seen[key] = rotation, min(cols)
+        for column in range(-min(cols), WIDTH - max(cols)):
+            rotations.append(rotation)
+            columns.append(column)
+            cells.append([(r, c + column) for r, c in shape.cells])
+            equivalents.append([(rotation, column)])
+    return np.array(rotations), np.array(columns), np.array(cells), equivalents
+
+
+PLACEMENTS = [_placements(sprite_type) for sprite_type in tetris.sprite_types]
+
+
+def column_tops(boards):
+    """Row of the highest filled cell of each column, HEIGHT if empty."""
+    filled = boards.any(axis=-2)
+    return np.where(filled, boards.argmax(axis=-2), HEIGHT)
+
+
+def drop(boards, type_index):
+    """Drop every placement of a sprite type on each of a stack of boards.
+
+    Return the boards after the drop and line clears, shaped (boards,
+    placements, HEIGHT, WIDTH), the lines cleared and whether each
+    placement fits in the board.
+    """
+    _, _, cells, _ = PLACEMENTS[type_index]
+    count, size = len(boards), len(cells)
+    rows, cols = cells[..., 0], cells[..., 1]
+    # The sprite stops as soon as one of its cells would enter a column
+    # below its top.
+    tops = column_tops(boards)[:, cols]
+    offsets = (tops - 1 - rows).min(axis=-1)
+    valid = offsets + rows.min(axis=-1) >= 0
+    results = np.repeat(boards[:, None], size, axis=1)
+    games = np.arange(count)[:, None, None]
+    placements = np.arange(size)[None, :, None]
+    results[games, placements, (offsets[..., None] + rows).clip(0, HEIGHT - 1), cols] = True
+    results, lines = tetris.remove_full_rows(results.reshape(count * size, HEIGHT, WIDTH))
+    return (results.reshape(count, size, HEIGHT, WIDTH), lines.reshape(count, size), valid)
+
+
+def features(boards):
+    """Aggregate height, holes and bumpiness of a stack of boards."""
+    heights = HEIGHT - column_tops(boards)
+    height = heights.sum(axis=-1)
+    # Every cell below a column top is either filled or a hole.
+    holes = height - np.count_nonzero(boards.reshape(boards.shape[:-2] + (-1,)), axis=-1)
+    bumpiness = np.abs(np.diff(heights, axis=-1)).sum(axis=-1)
+    return height, holes, bumpiness
+
+
+def score(boards, lines, weights=WEIGHTS):
+    height, holes, bumpiness = features(boards)
+    return weights[0] * height + weights[1] * lines + weights[2] * holes + weights[3] * bumpiness
+
+
+def lookahead_scores(job):
+    """Score each board by its best placement of the next sprite type.
+
+    job is (boards, lines, type_index, weights), lines being those
+    already cleared to reach each board; a board on which the next
+    sprite does not fit scores -inf.
+    """
+    boards, lines, type_index, weights = job
+    results, next_lines, valid = drop(boards, type_index)
+    scores = score(results, lines[:, None] + next_lines, weights)
+    return np.where(valid, scores, -np.inf).max(axis=1)
+
+
+class Autoplayer(object):
+    """Policy playing the best placement found for each sprite.
+
+    Use as a Simulator or GameLoop policy: once the placement is chosen,
+    the sprite is rotated then moved, one move per call, and dropped.
+    Given a multiprocessing pool, the lookahead boards are scored in
+    chunks over its processes, one per CPU unless told otherwise.
+    """
+
+    def __init__(self, weights=WEIGHTS, lookahead=True, pool=None, chunks=None):
+        self.weights = weights
+        self.lookahead = lookahead
+        self.pool = pool
+        self.chunks = chunks or (multiprocessing.cpu_count() if pool is not None else 1)
+        self.sprite = None
+        self.target = None
+        self.last = None
+
+    def search(self, board, type_index, next_type_index=None):
+        """Return the (rotation, column) pairs of the best placement on board.
+
+        Those are the rotations giving the same cells, and their columns;
+        None when no placement fits.
+        """
+        results, lines, valid = drop(board[None], type_index)
+        results, lines, valid = results[0], lines[0], valid[0]
+        if not valid.any():
+            return None
+        if next_type_index is None:
+            scores = score(results, lines, self.weights)
+        else:
+            jobs = [(boards, chunk_lines, next_type_index, self.weights) for boards, chunk_lines in zip(
+                np.array_split(results, self.chunks), np.array_split(lines, self.chunks))]
+            if self.pool is not None:
+                scores = np.concatenate(self.pool.map(lookahead_scores, jobs))
+            else:
+                scores = np.concatenate([lookahead_scores(job) for job in jobs])
+            # Dead ends still beat not fitting at all.
+            scores = np.where(np.isinf(scores), score(results, lines, self.weights) - 1e6, scores)
+        scores = np.where(valid, scores, -np.inf)
+        _, _, _, equivalents = PLACEMENTS[type_index]
+        return equivalents[scores.argmax()]
+
+    def _plan(self, controller):
+        board = controller.gamearea.matrix != 0
+        type_index = tetris.sprite_types.index(type(controller.sprite))
+        next_type_index = None
+        if self.lookahead:
+            next_type_index = tetris.sprite_types.index(type(controller.next_sprite))
+        self.target = self.search(board, type_index, next_type_index)
+
+    def __call__(self, controller):
+        if controller.sprite is not self.sprite:
+            self.sprite = controller.sprite
+            self.last = None
+            self._plan(controller)
+        if self.target is None:
+            return 'drop'
+        state = (controller.sprite.rotation, int(controller.position[1]))
+        if self.last is not None and self.last == state:
+            # The last move collided: land where we are.
+            return 'drop'
+        # Rotating the sprite into an equivalent rotation would only risk
+        # a collision: aim for the closest one.
+        rotation, column = min(self.target, key=lambda target: (target[0] - state[0]) % 4)
+        if state[0] != rotation:
+            move = 'rotate'
+        elif state[1] > column:
+            move = 'left'
+        elif state[1] < column:
+            move = 'right'
+        else:
+            return 'drop'
+        self.last = state
+        return move
+
+
+def play(job):
+    """Play one seeded game with an Autoplayer, return its GameResult."""
+    seed, lookahead, max_steps = job
+    random.seed(seed)
+    return simulator.Simulator(Autoplayer(lookahead=lookahead), max_steps=max_steps).play()
+
+
+def watch(lookahead, gravity):
+    """Play a game on the terminal, q to quit."""
+    gamearea = tetris.BitGameArea()
+    controller = tetris.Controller(gamearea)
+    display = tetris.Display(gamearea, controller)
+    controller.start()
+    try:
+        with tetris.Keyboard() as keyboard:
+            loop = tetris.GameLoop(controller, display, keyboard, gravity,
+                policy=Autoplayer(lookahead=lookahead))
+            try:
+                loop.run()
+            except tetris.GameOver:
+                pass
+        display.refresh()
+    finally:
+        display.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--games', type=int, default=100, help='Number of games.')
+    parser.add_argument('-m', '--max-steps', type=int, default=1000,
+        help='Stop each game after this many steps (default: %(default)s).')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Play games in this many processes (default: %(default)s).')
+    parser.add_argument('--no-lookahead', dest='lookahead', action='store_false',
+        help='Only score the placements of the current sprite.')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Seed of the first game.')
+    parser.add_argument('-w', '--watch', action='store_true', help='Play one game on the terminal.')
+    parser.add_argument('-g', '--gravity', type=float, default=0.1,
+        help='Seconds between steps down when watching (default: %(default)s).')
+    args = parser.parse_args()
+
+    if args.watch:
+        random.seed(args.seed)
+        try:
+            watch(args.lookahead, args.gravity)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    jobs = [(args.seed + i, args.lookahead, args.max_steps) for i in range(args.games)]
+    start = time.time()
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.map(play, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [play(job) for job in jobs]
+    simulator.summarize(results, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""Benchmark the TerminalTetris hot paths and whole games.
+
+Micro-benchmarks time single calls of the hot functions on boards
+reached by fixed seeded games, for every game area engine. Macro-
+benchmarks play whole seeded games in steps per second, headless and
+rendered to a null terminal. Results can be written as JSON and compared
+with those of a previous run, so that engines and representations can
+be compared on the same workload.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import time
+
+import numpy as np
+
+import simulator
+import tetris
+
+
+def best_time(function, min_time=0.2, repeat=3):
+    """Seconds per call of function, best of repeat runs of min_time."""
+    number = 1
+    while True:
+        start = time.time()
+        for _ in xrange(number):
+            function()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.time()
+        for _ in xrange(number):
+            function()
+        best = min(best, time.time() - start)
+    return best / number
+
+
+def midgame(engine, seed=0, steps=50):
+    """Controller of a seeded random game after some steps."""
+    random.seed(seed)
+    controller = tetris.Controller(tetris.game_areas[engine]())
+    controller.start()
+    for _ in range(steps):
+        controller.down()
+        getattr(controller, simulator.random_policy(controller))()
+    return controller
+
+
+def playing_down(engine, seed=0):
+    """Function stepping a seeded game down, restarting it when over."""
+    state = {'controller': None}
+
+    def down():
+        if state['controller'] is None:
+            state['controller'] = midgame(engine, seed, steps=0)
+        try:
+            state['controller'].down()
+        except tetris.GameOver:
+            state['controller'] = None
+
+    return down
+
+
+def micro_benchmarks(engines, min_time, repeat):
+    results = {}
+
+    def run(name, function):
+        results[name] = best_time(function, min_time, repeat) * 1e6
+        print('%-42s %10.2f us' % (name, results[name]))
+
+    controller = midgame('numpy')
+    matrix, sprite, position = controller.gamearea.matrix, controller.sprite, controller.position
+    sprite_matrix = sprite.matrix
+    run('compute_matrix_intersection_slices',
+        lambda: tetris.compute_matrix_intersection_slices(matrix, sprite_matrix, position))
+    scratch = matrix.copy()
+    run('merge_matrices', lambda: tetris.merge_matrices(scratch, sprite_matrix, position))
+    for engine in engines:
+        game = midgame(engine)
+        run('%s check_collision' % engine,
+            lambda: game.gamearea.check_collision(game.sprite, game.position))
+        run('%s Controller.down' % engine, playing_down(engine))
+    with open(os.devnull, 'w') as out:
+        display = tetris.Display(controller.gamearea, controller, out)
+        run('Display._frame', display._frame)
+        display.refresh()
+        moves = [controller.left, controller.right]
+
+        def refresh_after_move():
+            moves.reverse()
+            moves[0]()
+            display.refresh()
+
+        run('Display.refresh after a move', refresh_after_move)
+        run('Display.refresh from scratch', lambda: (setattr(display, 'previous', None), display.refresh()))
+    return results
+
+
+def play_rendered(engine, seed, max_steps, out):
+    """Play the game Simulator.play would, refreshing a Display each step."""
+    random.seed(seed)
+    gamearea = tetris.game_areas[engine]()
+    controller = tetris.Controller(gamearea)
+    display = tetris.Display(gamearea, controller, out)
+    controller.start()
+    steps = 0
+    try:
+        while max_steps is None or steps < max_steps:
+            controller.down()
+            getattr(controller, simulator.random_policy(controller))()
+            display.refresh()
+            steps += 1
+    except tetris.GameOver:
+        pass
+    return steps
+
+
+def macro_benchmarks(engines, games, max_steps):
+    results = {}
+
+    def run(name, play):
+        start = time.time()
+        steps = sum(play(seed) for seed in range(games))
+        elapsed = time.time() - start
+        results[name] = {'steps': steps, 'seconds': elapsed, 'steps_per_s': steps / elapsed}
+        print('%-42s %10.0f steps/s' % (name, results[name]['steps_per_s']))
+
+    for engine in engines:
+        sim = simulator.Simulator(engine=engine, max_steps=max_steps)
+
+        def headless(seed):
+            random.seed(seed)
+            return sim.play().steps
+
+        run('%s headless' % engine, headless)
+        with open(os.devnull, 'w') as out:
+            run('%s rendered' % engine, lambda seed: play_rendered(engine, seed, max_steps, out))
+    return results
+
+
+def compare(results, baseline):
+    """Print each benchmark result against the baseline one."""
+    for name, us in sorted(results['micro'].items()):
+        if name in baseline.get('micro', {}):
+            print('%-42s %8.2fx faster' % (name, baseline['micro'][name] / us))
+    for name, result in sorted(results['macro'].items()):
+        if name in baseline.get('macro', {}):
+            print('%-42s %8.2fx faster' % (name, result['steps_per_s'] / baseline['macro'][name]['steps_per_s']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-e', '--engine', choices=sorted(tetris.game_areas), action='append',
+        help='Game area engine to benchmark; repeat for several (default: all).')
+    parser.add_argument('-n', '--games', type=int, default=50,
+        help='Seeded games per macro-benchmark (default: %(default)s).')
+    parser.add_argument('-m', '--max-steps', type=int, default=2000,
+        help='Stop each game after this many steps (default: %(default)s).')
+    parser.add_argument('-t', '--min-time', type=float, default=0.2,
+        help='Seconds each micro-benchmark run lasts at least (default: %(default)s).')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='Runs of each micro-benchmark; the fastest one is kept.')
+    parser.add_argument('--no-micro', dest='micro', action='store_false', help='Skip micro-benchmarks.')
+    parser.add_argument('--no-macro', dest='macro', action='store_false', help='Skip macro-benchmarks.')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this path.')
+    parser.add_argument('-b', '--baseline', help='Compare with this previous JSON output.')
+    args = parser.parse_args()
+
+    engines = args.engine or sorted(tetris.game_areas)
+    results = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'games': args.games,
+        'max_steps': args.max_steps,
+        'micro': micro_benchmarks(engines, args.min_time, args.repeat) if args.micro else {},
+        'macro': macro_benchmarks(engines, args.games, args.max_steps) if args.macro else {},
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
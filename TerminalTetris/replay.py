@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""Record TerminalTetris games in a compact replay file, and replay them.
+
+A game is fully determined by the seed of its sprites and the moves
+played, whether from the keyboard, gravity or a policy. A replay file
+holds a header:
+
+    magic 'TTR', version, height, width (bytes), seed (uint64),
+    move count (uint32), SHA-1 of the final board (20 bytes)
+
+followed by the moves, one 4-bit code per move, two to a byte, high
+nibble first. Replaying runs the moves headless as fast as possible and
+checks the final board hash, so a replay is both a regression test and
+a benchmark workload.
+"""
+
+import argparse
+import hashlib
+import random
+import struct
+import sys
+import time
+
+import numpy as np
+
+import tetris
+
+
+MAGIC = b'TTR'
+VERSION = 1
+HEADER = struct.Struct('<3sBBBQI20s')
+
+MOVES = ('down', 'left', 'right', 'rotate', 'drop')
+CODES = dict((move, code) for code, move in enumerate(MOVES))
+PAD = 0xf
+
+
+class ReplayError(Exception):
+    pass
+
+
+def board_hash(gamearea):
+    """SHA-1 of the cell ids of a game area, the same for every engine."""
+    return hashlib.sha1(gamearea.matrix.astype('<i4').tostring()).digest()
+
+
+class Recorder(object):
+    """Controller proxy recording the moves played through it.
+
+    Stand it in for the Controller given to a GameLoop or a policy; the
+    rest of the Controller is reached through it.
+    """
+
+    def __init__(self, controller, seed):
+        self.controller = controller
+        self.seed = seed
+        self.codes = []
+
+    def __getattr__(self, name):
+        return getattr(self.controller, name)
+
+    def _play(self, move):
+        self.codes.append(CODES[move])
+        getattr(self.controller, move)()
+
+    def down(self):
+        self._play('down')
+
+    def left(self):
+        self._play('left')
+
+    def right(self):
+        self._play('right')
+
+    def rotate(self):
+        self._play('rotate')
+
+    def drop(self):
+        self._play('drop')
+
+    def save(self, path):
+        height, width = self.controller.gamearea.shape
+        codes = np.array(self.codes, dtype=np.uint8)
+        if len(codes) % 2:
+            codes = np.append(codes, np.uint8(PAD))
+        packed = (codes[0::2] << 4) | codes[1::2]
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, height, width, self.seed,
+                len(self.codes), board_hash(self.controller.gamearea)))
+            f.write(packed.tostring())
+
+
+class Replay(object):
+    """Content of a replay file."""
+
+    def __init__(self, shape, seed, codes, digest):
+        self.shape = shape
+        self.seed = seed
+        self.codes = codes
+        self.digest = digest
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ReplayError('%s: truncated header' % path)
+        magic, version, height, width, seed, count, digest = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ReplayError('%s: not a version %d replay' % (path, VERSION))
+        packed = np.frombuffer(data, dtype=np.uint8, offset=HEADER.size)
+        if len(packed) != (count + 1) // 2:
+            raise ReplayError('%s: %d moves announced, %d bytes of moves' % (path, count, len(packed)))
+        codes = np.empty(2 * len(packed), dtype=np.uint8)
+        codes[0::2] = packed >> 4
+        codes[1::2] = packed & 0xf
+        return cls((height, width), seed, codes[:count], digest)
+
+    def play(self, engine='bitboard'):
+        """Replay the moves headless, return the game area at the end.
+
+        Raise ReplayError if the game ends before the last move, or ends
+        on another board than the recorded one.
+        """
+        game_area_type = tetris.game_areas[engine]
+        if tuple(game_area_type.shape) != self.shape:
+            raise ReplayError('recorded on a %dx%d game area' % self.shape)
+        controller = tetris.Controller(game_area_type(), random.Random(self.seed))
+        controller.start()
+        methods = [getattr(controller, move) for move in MOVES]
+        codes = self.codes.tolist()
+        for i, code in enumerate(codes):
+            try:
+                methods[code]()
+            except tetris.GameOver:
+                if i != len(codes) - 1:
+                    raise ReplayError('game over at move %d of %d' % (i + 1, len(codes)))
+        if board_hash(controller.gamearea) != self.digest:
+            raise ReplayError('final board differs from the recorded one')
+        return controller.gamearea
+
+
+def record(path, seed, policy, max_steps=None, engine='bitboard'):
+    """Play a headless game with a Simulator policy, save its replay."""
+    controller = tetris.Controller(tetris.game_areas[engine](), random.Random(seed))
+    recorder = Recorder(controller, seed)
+    controller.start()
+    steps = 0
+    try:
+        while max_steps is None or steps < max_steps:
+            recorder.down()
+            move = policy(recorder)
+            if move is not None:
+                getattr(recorder, move)()
+            steps += 1
+    except tetris.GameOver:
+        pass
+    recorder.save(path)
+    return recorder
+
+
+def record_interactive(path, seed, gravity):
+    """Play on the terminal, save the replay on game over or q."""
+    gamearea = tetris.BitGameArea()
+    controller = tetris.Controller(gamearea, random.Random(seed))
+    recorder = Recorder(controller, seed)
+    display = tetris.Display(gamearea, controller)
+    controller.start()
+    try:
+        with tetris.Keyboard() as keyboard:
+            try:
+                tetris.GameLoop(recorder, display, keyboard, gravity).run()
+            except tetris.GameOver:
+                pass
+        display.refresh()
+    finally:
+        display.close()
+        recorder.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command')
+    recorder = subparsers.add_parser('record', help='Record a game.')
+    recorder.add_argument('path', help='Replay file to write.')
+    recorder.add_argument('-s', '--seed', type=int, default=0, help='Random seed (default: %(default)s).')
+    recorder.add_argument('-p', '--policy', choices=['keyboard', 'random', 'ai'], default='keyboard',
+        help='Who plays (default: %(default)s).')
+    recorder.add_argument('-m', '--max-steps', type=int,
+        help='Stop a random or ai game after this many steps.')
+    recorder.add_argument('-g', '--gravity', type=float, default=0.5,
+        help='Seconds between steps down on the keyboard (default: %(default)s).')
+    player = subparsers.add_parser('play', help='Replay games, checking their final boards.')
+    player.add_argument('paths', nargs='+', metavar='path', help='Replay files.')
+    player.add_argument('-e', '--engine', choices=sorted(tetris.game_areas), default='bitboard',
+        help='Game area implementation (default: %(default)s).')
+    player.add_argument('-n', '--repeat', type=int, default=1,
+        help='Times each replay is played; the fastest one is reported.')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        if args.policy == 'keyboard':
+            try:
+                record_interactive(args.path, args.seed, args.gravity)
+            except KeyboardInterrupt:
+                pass
+            return
+        if args.policy == 'ai':
+            import ai
+            policy = ai.Autoplayer()
+        else:
+            policy = tetris.random_move
+        recorder = record(args.path, args.seed, policy, args.max_steps)
+        print('%s: %d moves, %d sprites, %d lines' % (
+            args.path, len(recorder.codes), recorder.sprite_count, recorder.lines))
+        return
+
+    failed = False
+    for path in args.paths:
+        try:
+            replay = Replay.load(path)
+            best = None
+            for _ in range(args.repeat):
+                start = time.time()
+                replay.play(args.engine)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+        except ReplayError as e:
+            failed = True
+            print('%s: FAILED: %s' % (path, e))
+            continue
+        print('%s: ok, %d moves in %.3fs: %.0f moves/s' % (
+            path, len(replay.codes), best, len(replay.codes) / best if best else 0))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""Play TerminalTetris games headless, as fast as possible.
+
+Simulator plays one game at a time with the Controller and a game area
+engine, with no display and no delay. BatchSimulator plays thousands of
+games at once on a stack of boards, one NumPy operation per step for
+all of them.
+"""
+
+import argparse
+import collections
+import random
+import time
+
+import numpy as np
+
+import tetris
+
+
+MOVES = ('left', 'right', 'rotate')
+
+GameResult = collections.namedtuple('GameResult', 'sprites lines steps')
+
+
+def random_policy(controller):
+    """Play like tetris.main: a random move after each step down."""
+    return random.choice(MOVES)
+
+
+class Simulator(object):
+    """Play games with a policy choosing a move, or None, at each step.
+
+    The policy is called with the Controller after the sprite went down.
+    Given tetris.Instruments, every game played is instrumented. shape
+    and types, if given, replace the game area shape and the sprite types
+    drawn (see tetris.Controller).
+    """
+
+    def __init__(self, policy=random_policy, engine='bitboard', max_steps=None, instruments=None,
+            shape=None, types=None):
+        self.policy = policy
+        self.game_area_type = tetris.game_areas[engine]
+        if shape is not None:
+            self.game_area_type = type(self.game_area_type.__name__, (self.game_area_type,),
+                {'shape': tuple(shape)})
+        self.max_steps = max_steps
+        self.instruments = instruments
+        self.types = types
+
+    def play(self):
+        controller = tetris.Controller(self.game_area_type(), types=self.types)
+        if self.instruments is not None:
+            self.instruments.instrument(controller)
+        controller.start()
+        steps = 0
+        try:
+            while self.max_steps is None or steps < self.max_steps:
+                controller.down()
+                move = self.policy(controller)
+                if move is not None:
+                    getattr(controller, move)()
+                steps += 1
+        except tetris.GameOver:
+            pass
+        return GameResult(controller.sprite_count, controller.lines, steps)
+
+    def play_many(self, count):
+        return [self.play() for _ in range(count)]
+
+
+# Cells, spawn rows and widths of each sprite type and rotation.
+CELLS = np.array([[shape.cells for shape in t.rotations] for t in tetris.sprite_types])
+SPAWN_ROWS = np.array([[shape.spawn_row for shape in t.rotations] for t in tetris.sprite_types])
+WIDTHS = np.array([[shape.width for shape in t.rotations] for t in tetris.sprite_types])
+
+NONE, LEFT, RIGHT, ROTATE = range(4)
+
+
+def random_actions(simulator):
+    return simulator.rng.randint(LEFT, ROTATE + 1, size=len(simulator.boards))
+
+
+class BatchSimulator(object):
+    """Play count games at once, stepping all the boards together.
+
+    Games follow the Controller rules: at each step the sprite goes down
+    (landing, clearing full lines and spawning the next sprite if it
+    cannot), then the action of the policy is applied if it does not
+    collide. Finished games are left untouched.
+    """
+
+    def __init__(self, count, shape=tetris.GameArea.shape, seed=None):
+        self.rng = np.random.RandomState(seed)
+        self.height, self.width = shape
+        self.boards = np.zeros((count,) + tuple(shape), dtype=bool)
+        self.done = np.zeros(count, dtype=bool)
+        self.sprites = np.zeros(count, dtype=int)
+        self.lines = np.zeros(count, dtype=int)
+        self.steps = np.zeros(count, dtype=int)
+        self.types, self.rotations = self._draw(count)
+        self.rows = np.zeros(count, dtype=int)
+        self.cols = np.zeros(count, dtype=int)
+        self.next_types, self.next_rotations = self._draw(count)
+        self._next(np.arange(count))
+
+    def _draw(self, count):
+        types = self.rng.randint(len(tetris.sprite_types), size=count)
+        return types, self.rng.randint(4, size=count)
+
+    def _cells(self, games, rotations, rows, cols):
+        cells = CELLS[self.types[games], rotations]
+        return rows[:, None] + cells[..., 0], cols[:, None] + cells[..., 1]
+
+    def _collides(self, games, rotations, rows, cols):
+        rows, cols = self._cells(games, rotations, rows, cols)
+        out = (rows < 0) | (rows >= self.height) | (cols < 0) | (cols >= self.width)
+        hit = self.boards[games[:, None],
+            rows.clip(0, self.height - 1), cols.clip(0, self.width - 1)]
+        return (out | hit).any(axis=1)
+
+    def _freeze(self, games):
+        rows, cols = self._cells(games, self.rotations[games], self.rows[games], self.cols[games])
+        inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        games = np.broadcast_to(games[:, None], rows.shape)
+        self.boards[games[inside], rows[inside], cols[inside]] = True
+
+    def _clear_lines(self, games):
+        boards, counts = tetris.remove_full_rows(self.boards[games])
+        if counts.any():
+            self.boards[games] = boards
+            self.lines[games] += counts
+
+    def _next(self, games):
+        self.types[games] = self.next_types[games]
+        self.rotations[games] = self.next_rotations[games]
+        self.next_types[games], self.next_rotations[games] = self._draw(len(games))
+        types, rotations = self.types[games], self.rotations[games]
+        self.rows[games] = SPAWN_ROWS[types, rotations]
+        self.cols[games] = (self.width - WIDTHS[types, rotations]) // 2
+        self.sprites[games] += 1
+        over = games[self._collides(games, rotations, self.rows[games], self.cols[games])]
+        if len(over):
+            self._freeze(over)
+            self.done[over] = True
+
+    def down(self):
+        games = np.flatnonzero(~self.done)
+        rows = self.rows[games] + 1
+        landed = self._collides(games, self.rotations[games], rows, self.cols[games])
+        self.rows[games[~landed]] += 1
+        games = games[landed]
+        if len(games):
+            self._freeze(games)
+            self._clear_lines(games)
+            self._next(games)
+
+    def move(self, actions):
+        live = ~self.done
+        for action, delta in ((LEFT, -1), (RIGHT, +1)):
+            games = np.flatnonzero(live & (actions == action))
+            cols = self.cols[games] + delta
+            ok = ~self._collides(games, self.rotations[games], self.rows[games], cols)
+            self.cols[games[ok]] = cols[ok]
+        games = np.flatnonzero(live & (actions == ROTATE))
+        rotations = (self.rotations[games] + 1) % 4
+        ok = ~self._collides(games, rotations, self.rows[games], self.cols[games])
+        self.rotations[games[ok]] = rotations[ok]
+
+    def step(self, actions):
+        live = ~self.done
+        self.down()
+        self.move(actions)
+        self.steps[live] += 1
+
+    def run(self, policy=random_actions, max_steps=None):
+        """Step until every game is over, return their GameResults."""
+        step = 0
+        while not self.done.all() and (max_steps is None or step < max_steps):
+            self.step(policy(self))
+            step += 1
+        return [GameResult(*result) for result in zip(
+            self.sprites.tolist(), self.lines.tolist(), self.steps.tolist())]
+
+
+def summarize(results, elapsed):
+    steps = sum(r.steps for r in results)
+    print('%d games, %d steps in %.2fs: %.0f games/s, %.0f steps/s' % (
+        len(results), steps, elapsed, len(results) / elapsed, steps / elapsed))
+    print('mean %.1f sprites, %.2f lines per game' % (
+        float(sum(r.sprites for r in results)) / len(results),
+        float(sum(r.lines for r in results)) / len(results)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--games', type=int, default=100, help='Number of games.')
+    parser.add_argument('-e', '--engine', choices=sorted(tetris.game_areas), default='bitboard',
+        help='Game area implementation (default: %(default)s).')
+    parser.add_argument('-b', '--batch', action='store_true',
+        help='Play all games at once on stacked boards.')
+    parser.add_argument('-s', '--seed', type=int, help='Random seed.')
+    parser.add_argument('--profile', action='store_true',
+        help='Count and time the hot paths of the games (not in batch).')
+    args = parser.parse_args()
+
+    instruments = tetris.Instruments() if args.profile and not args.batch else None
+    start = time.time()
+    if args.batch:
+        results = BatchSimulator(args.games, seed=args.seed).run()
+    else:
+        random.seed(args.seed)
+        results = Simulator(engine=args.engine, instruments=instruments).play_many(args.games)
+    summarize(results, time.time() - start)
+    if instruments is not None:
+        instruments.summary()
+
+
+if __name__ == '__main__':
+    main()
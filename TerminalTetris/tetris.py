@@ -4,26 +4,67 @@ import logging
 import numpy as np
 
 
+class SpriteShape(object):
+    """One rotation of a sprite type, computed once and shared by all sprites."""
+
+    __slots__ = ('matrix', 'height', 'width', 'spawn_row', 'cells', 'masks')
+
+    def __init__(self, blocks):
+        self.matrix = np.array(blocks, dtype=int)
+        self.matrix.setflags(write=False)
+        self.height, self.width = self.matrix.shape
+        rows = [i for i, row in enumerate(self.matrix) if row.any()]
+        # Starting row so that the first non empty row shows at the top.
+        self.spawn_row = -rows[0]
+        self.cells = tuple(zip(*[axis.tolist() for axis in np.nonzero(self.matrix)]))
+        # (row, bitmask) of each non empty row, bit j set for column j.
+        self.masks = tuple(
+            (i, sum(1 << j for j, cell in enumerate(self.matrix[i]) if cell))
+            for i in rows
+        )
+
+
 class BaseSprite(object):
+    """Handle on a sprite: its type, rotation and id.
 
-    matrix = (())
+    Subclasses give their blocks; the shapes of their four rotations are
+    tabulated at import, so rotating is a lookup.
+    """
 
-    def __init__(self, id_=1):
-        self.logger = logging.getLogger(type(self).__name__)
-        self.matrix = np.array(self.matrix, dtype=int) * id_
-        self.logger.debug('\n' + str(self))
+    __slots__ = ('rotation', 'id')
+
+    blocks = (())
+    rotations = ()
+    logger = logging.getLogger('BaseSprite')
+
+    def __init__(self, id_=1, rotation=0):
+        self.id = id_
+        self.rotation = rotation % 4
+
+    @property
+    def shape(self):
+        return self.rotations[self.rotation]
+
+    @property
+    def matrix(self):
+        return self.rotations[self.rotation].matrix * self.id
 
     @property
     def height(self):
-        return self.matrix.shape[0]
+        return self.rotations[self.rotation].height
 
     @property
     def width(self):
-        return self.matrix.shape[1]
+        return self.rotations[self.rotation].width
+
+    @property
+    def masks(self):
+        return self.rotations[self.rotation].masks
 
     def rotate(self, nb=1):
-        self.matrix = np.rot90(self.matrix, nb)
-        self.logger.debug('\n' + str(self))
+        self.rotation = (self.rotation + nb) % 4
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('\n' + str(self))
 
     def unrotate(self, nb=1):
         self.rotate(-nb)
@@ -35,7 +76,9 @@ class BaseSprite(object):
 
 class ISprite(BaseSprite):
 
-     matrix = (
+    __slots__ = ()
+
+    blocks = (
         (0, 1, 0, 0),
         (0, 1, 0, 0),
         (0, 1, 0, 0),
@@ -45,7 +88,9 @@ class ISprite(BaseSprite):
 
 class OSprite(BaseSprite):
 
-    matrix = (
+    __slots__ = ()
+
+    blocks = (
         (1, 1),
         (1, 1),
     )
@@ -53,7 +98,9 @@ class OSprite(BaseSprite):
 
 class TSprite(BaseSprite):
 
-    matrix = (
+    __slots__ = ()
+
+    blocks = (
         (0, 0, 0),
         (1, 1, 1),
         (0, 1, 0),
@@ -62,7 +109,9 @@ class TSprite(BaseSprite):
 
 class LSprite(BaseSprite):
 
-    matrix = (
+    __slots__ = ()
+
+    blocks = (
         (0, 1, 0),
         (0, 1, 0),
         (0, 1, 1),
@@ -71,7 +120,9 @@ class LSprite(BaseSprite):
 
 class JSprite(BaseSprite):
 
-    matrix = (
+    __slots__ = ()
+
+    blocks = (
         (0, 1, 0),
         (0, 1, 0),
         (1, 1, 0),
@@ -80,7 +131,9 @@ class JSprite(BaseSprite):
 
 class ZSprite(BaseSprite):
 
-    matrix = (
+    __slots__ = ()
+
+    blocks = (
         (0, 0, 0),
         (1, 1, 0),
         (0, 1, 1),
@@ -89,7 +142,9 @@ class ZSprite(BaseSprite):
 
 class SSprite(BaseSprite):
 
-    matrix = (
+    __slots__ = ()
+
+    blocks = (
         (0, 0, 0),
         (0, 1, 1),
         (1, 1, 0),
@@ -106,6 +161,11 @@ sprite_types = [
     SSprite,
 ]
 
+for sprite_type in sprite_types:
+    sprite_type.logger = logging.getLogger(sprite_type.__name__)
+    sprite_type.rotations = tuple(SpriteShape(np.rot90(sprite_type.blocks, nb)) for nb in range(4))
+del sprite_type
+
 
 import random
 
@@ -123,27 +183,32 @@ class GameOver(TetrisError):
 
 
 class  Controller(object):
+    """Play sprites on a game area, drawn from rng (default: random).
+
+    Sprites are drawn uniformly from types; repeat a type to make it more
+    frequent.
+    """
 
-    def __init__(self, gamearea):
+    def __init__(self, gamearea, rng=random, types=None):
         self.logger = logging.getLogger(type(self).__name__)
+        # Levels are read once, so that disabled logging costs a test in
+        # the hot paths: configure logging before starting a game.
+        self.log_info = self.logger.isEnabledFor(logging.INFO)
+        self.log_debug = self.logger.isEnabledFor(logging.DEBUG)
         self.gamearea = gamearea
+        self.rng = rng
+        self.types = types or sprite_types
         self.sprite_count = 0
+        self.lines = 0
 
     def _prepare_new_sprite(self):
         self.sprite_count += 1
-        sprite = random.choice(sprite_types)(self.sprite_count)
-        sprite.rotate(random.randint(0, 3))
-        return sprite
+        sprite_type = self.rng.choice(self.types)
+        return sprite_type(self.sprite_count, self.rng.randint(0, 3))
 
     def _compute_initial_position(self, sprite):
-        #XXX compute starting row (how ugly!)
-        row = 0
-        for x in np.packbits(sprite.matrix, 1).flatten():
-            if x > 0:
-                break
-            row -= 1
-        hcenter = round((self.gamearea.width - self.sprite.width) / 2)
-        position = np.array((row, hcenter))
+        shape = sprite.shape
+        position = np.array((shape.spawn_row, (self.gamearea.width - shape.width) // 2))
         return position
 
     def start(self):
@@ -151,59 +216,79 @@ class  Controller(object):
         self.next()
 
     def next(self):
-        self.logger.info('next')
+        if self.log_info:
+            self.logger.info('next')
         self.sprite, self.next_sprite = self.next_sprite, self._prepare_new_sprite()
         self.position = self._compute_initial_position(self.sprite)
-        self.logger.debug(self)
+        if self.log_debug:
+            self.logger.debug(self)
         try:
             self.gamearea.check_collision(self.sprite, self.position)
         except Collision:
             self.gamearea.freeze_sprite(self.sprite, self.position)
-            self.logger.info('game over')
+            if self.log_info:
+                self.logger.info('game over')
             raise GameOver('gamearea filled')
 
     def rotate(self):
-        self.logger.info('rotate')
+        if self.log_info:
+            self.logger.info('rotate')
         self.sprite.rotate()
         try:
             self.gamearea.check_collision(self.sprite, self.position)
         except Collision:
-            self.logger.debug('rewind')
+            if self.log_debug:
+                self.logger.debug('rewind')
             self.sprite.unrotate()
 
     def left(self):
-        self.logger.info('left')
+        if self.log_info:
+            self.logger.info('left')
         try:
             self._move(np.array((0, -1)))
         except Collision:
             pass
 
     def right(self):
-        self.logger.info('right')
+        if self.log_info:
+            self.logger.info('right')
         try:
             self._move(np.array((0, +1)))
         except Collision:
             pass
 
     def down(self):
-        self.logger.info('down')
+        if self.log_info:
+            self.logger.info('down')
         try:
             self._move(np.array((+1, 0)))
         except Collision:
             # sprite is back to previous position already
             self.gamearea.freeze_sprite(self.sprite, self.position)
+            self.lines += self.gamearea.clear_lines()
             self.next()
 
+    def drop(self):
+        """Move the sprite down until it freezes."""
+        if self.log_info:
+            self.logger.info('drop')
+        sprite = self.sprite
+        while self.sprite is sprite:
+            self.down()
+
     def _move(self, vector):
         previous_position = self.position.copy()
         self.position += vector
-        self.logger.debug(self)
+        if self.log_debug:
+            self.logger.debug(self)
         try:
             self.gamearea.check_collision(self.sprite, self.position)
         except Collision:
-            self.logger.debug('rewind')
+            if self.log_debug:
+                self.logger.debug('rewind')
             self.position = previous_position
-            self.logger.debug(self)
+            if self.log_debug:
+                self.logger.debug(self)
             raise  # 'down' needs to know about the collision
 
     def __str__(self):
@@ -233,12 +318,38 @@ def merge_matrices(a, b, position):
     return a
 
 
+def remove_matrix_rows(a, rows):
+    """Remove the rows selected by a boolean array, shift the others down."""
+    count = int(np.count_nonzero(rows))
+    if count:
+        a = np.concatenate((np.zeros((count, a.shape[1]), dtype=a.dtype), a[~rows]))
+    return a, count
+
+
+def remove_full_rows(boards):
+    """Remove the full rows of a stack of boolean boards, shift the others down.
+
+    Return the boards and how many rows were removed from each.
+    """
+    full = boards.all(axis=-1)
+    counts = full.sum(axis=-1)
+    if counts.any():
+        # Full rows first, the others in order below them, then blank the
+        # full ones.
+        order = np.argsort(~full, axis=-1, kind='mergesort')
+        boards = boards[np.arange(len(boards))[:, None], order]
+        boards[np.arange(boards.shape[1]) < counts[:, None]] = False
+    return boards, counts
+
+
 class GameArea(object):
 
     shape = (20, 10)
 
     def __init__(self):
         self.logger = logging.getLogger(type(self).__name__)
+        self.log_info = self.logger.isEnabledFor(logging.INFO)
+        self.log_debug = self.logger.isEnabledFor(logging.DEBUG)
         self.matrix = np.zeros(self.shape, dtype=int)
 
     @property
@@ -252,23 +363,110 @@ class GameArea(object):
     def check_collision(self, sprite, position):
         bgmatrix, fgmatrix = get_matrix_intersections(self.matrix, sprite.matrix, position)
         bgmatrix, fgmatrix = np.sign(bgmatrix),  np.sign(fgmatrix)
-        self.logger.debug('checking collision\n' + '\n'.join([' '.join(map(str, rows))
-            for rows in zip(fgmatrix, bgmatrix, fgmatrix + bgmatrix)]))
+        if self.log_debug:
+            self.logger.debug('checking collision\n' + '\n'.join([' '.join(map(str, rows))
+                for rows in zip(fgmatrix, bgmatrix, fgmatrix + bgmatrix)]))
         if np.sum(fgmatrix) != np.sum(np.sign(sprite.matrix)):
-            self.logger.info('out of bound!')
+            if self.log_info:
+                self.logger.info('out of bound!')
             raise Collision('out of bound')
         if np.bitwise_and(fgmatrix, bgmatrix).any():
-            self.logger.info('collision!')
+            if self.log_info:
+                self.logger.info('collision!')
             raise Collision('collision')
-        self.logger.info('no collision')
+        if self.log_info:
+            self.logger.info('no collision')
 
     def freeze_sprite(self, sprite, position):
         merge_matrices(self.matrix, sprite.matrix, position)
-        self.logger.info('shape freezed')
+        if self.log_info:
+            self.logger.info('shape freezed')
 
+    def clear_lines(self):
+        """Remove full lines, return how many."""
+        self.matrix, count = remove_matrix_rows(self.matrix, (self.matrix != 0).all(axis=1))
+        if count and self.log_info:
+            self.logger.info('%d lines cleared', count)
+        return count
 
-import itertools
-import os
+
+class BitGameArea(object):
+    """GameArea storing each row as an integer bitmask.
+
+    Bit PAD + j of a row is set when its column j is filled, and the PAD
+    bits on each side are walls, so that a collision or a move out of
+    bound costs a shift and an and per sprite row. matrix is kept along
+    as the cell-id view Display draws, updated on freezes only.
+    """
+
+    shape = GameArea.shape
+    PAD = 4
+
+    def __init__(self):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.log_info = self.logger.isEnabledFor(logging.INFO)
+        self.log_debug = self.logger.isEnabledFor(logging.DEBUG)
+        height, width = self.shape
+        self.full = (1 << (width + 2 * self.PAD)) - 1
+        self.walls = self.full ^ (((1 << width) - 1) << self.PAD)
+        self.rows = [self.walls] * height
+        self.matrix = np.zeros(self.shape, dtype=int)
+
+    @property
+    def height(self):
+        return self.shape[0]
+
+    @property
+    def width(self):
+        return self.shape[1]
+
+    def check_collision(self, sprite, position):
+        top, shift = int(position[0]), int(position[1]) + self.PAD
+        rows = self.rows
+        masks = sprite.masks
+        if top + masks[0][0] < 0 or top + masks[-1][0] >= len(rows) or shift < 0:
+            if self.log_info:
+                self.logger.info('out of bound!')
+            raise Collision('out of bound')
+        for i, mask in masks:
+            mask <<= shift
+            if mask & rows[top + i]:
+                if mask & self.walls:
+                    if self.log_info:
+                        self.logger.info('out of bound!')
+                    raise Collision('out of bound')
+                if self.log_info:
+                    self.logger.info('collision!')
+                raise Collision('collision')
+
+    def freeze_sprite(self, sprite, position):
+        top, shift = int(position[0]), int(position[1]) + self.PAD
+        for i, mask in sprite.masks:
+            self.rows[top + i] |= mask << shift
+        merge_matrices(self.matrix, sprite.matrix, position)
+        if self.log_info:
+            self.logger.info('shape freezed')
+
+    def clear_lines(self):
+        """Remove full lines, return how many."""
+        full = self.full
+        kept = [row for row in self.rows if row != full]
+        count = len(self.rows) - len(kept)
+        if count:
+            self.matrix, _ = remove_matrix_rows(self.matrix, np.array([row == full for row in self.rows]))
+            self.rows = [self.walls] * count + kept
+            if self.log_info:
+                self.logger.info('%d lines cleared', count)
+        return count
+
+
+game_areas = {
+    'numpy': GameArea,
+    'bitboard': BitGameArea,
+}
+
+
+import sys
 import termcolor
 
 from termcolor import colored
@@ -278,62 +476,286 @@ color_names = termcolor.COLORS.keys()
 
 
 class Display(object):
+    """Draw the game area and the next sprite on an ANSI terminal.
+
+    Each refresh compares the cells of the new frame with those of the
+    previous one, and redraws only the cells that changed, with cursor
+    addressing, in a single write.
+    """
+
+    gap = 4  # spaces between the game area border and the next sprite
 
-    def __init__(self, gamearea, controller):
+    def __init__(self, gamearea, controller, out=sys.stdout):
         self.gamearea = gamearea
         self.controller = controller
+        self.out = out
+        self.glyphs = [colored('#', color) for color in color_names]
+        self.previous = None
+
+    def _frame(self):
+        # Cell values of the game area with its sprite, then of the next
+        # sprite one row down on the right.
+        height, width = self.gamearea.matrix.shape
+        frame = np.zeros((height, width + 4), dtype=int)
+        frame[:, :width] = self.gamearea.matrix
+        merge_matrices(frame[:, :width], self.controller.sprite.matrix, self.controller.position)
+        sprite = self.controller.next_sprite.matrix
+        frame[1:1 + sprite.shape[0], width:width + sprite.shape[1]] = sprite
+        return frame
+
+    def _redraw(self, frame):
+        # Clear the screen and draw what never changes: the borders.
+        height, width = self.gamearea.matrix.shape
+        parts = ['\x1b[?25l\x1b[2J']
+        for row in range(1, height + 1):
+            parts.append('\x1b[%d;1H|\x1b[%d;%dH|' % (row, row, 2 * width + 3))
+        # Screen column, from 1, of each frame column: '| ' then a cell
+        # every other column, ' |', the gap and the next sprite alike.
+        columns = [3 + 2 * col for col in range(width)]
+        columns.extend(2 * width + 4 + self.gap + 2 * col for col in range(frame.shape[1] - width))
+        self.columns = columns
+        self.previous = np.full(frame.shape, -1, dtype=int)
+        return parts
+
+    def refresh(self):
+        frame = self._frame()
+        parts = []
+        if self.previous is None or self.previous.shape != frame.shape:
+            parts = self._redraw(frame)
+        glyphs, columns = self.glyphs, self.columns
+        for row, col in zip(*np.nonzero(frame != self.previous)):
+            value = frame[row, col]
+            parts.append('\x1b[%d;%dH' % (row + 1, columns[col]))
+            parts.append(glyphs[value % len(glyphs)] if value else ' ')
+        parts.append('\x1b[%d;1H' % (frame.shape[0] + 1))
+        self.previous = frame
+        self.out.write(''.join(parts))
+        self.out.flush()
+
+    def close(self):
+        """Show the cursor again, below the game."""
+        self.out.write('\x1b[%d;1H\x1b[?25h' % (self.gamearea.matrix.shape[0] + 1))
+        self.out.flush()
+
+
+import argparse
+import collections
+import os
+import select
+import termios
+import time
+import tty
+
+
+class Keyboard(object):
+    """Read keys from a terminal without blocking nor waiting for Enter.
+
+    Use as a context manager: the terminal is in cbreak mode within it.
+    """
+
+    keys = {
+        '\x1b[D': 'left',
+        '\x1b[C': 'right',
+        '\x1b[A': 'rotate',
+        '\x1b[B': 'down',
+        'h': 'left',
+        'l': 'right',
+        'k': 'rotate',
+        'j': 'down',
+        ' ': 'drop',
+        'q': 'quit',
+    }
+
+    def __init__(self, stream=sys.stdin):
+        self.fd = stream.fileno()
+        self.attributes = None
+
+    def __enter__(self):
+        if os.isatty(self.fd):
+            self.attributes = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.attributes is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.attributes)
+
+    def read(self, timeout):
+        """Wait up to timeout seconds for input, return the actions typed."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 1024)
+        if not data:
+            return ['quit']
+        actions = []
+        i = 0
+        while i < len(data):
+            size = 3 if data.startswith('\x1b[', i) else 1
+            action = self.keys.get(data[i:i + size])
+            if action is not None:
+                actions.append(action)
+            i += size
+        return actions
+
+
+class GameLoop(object):
+    """Run the game on a fixed timestep, decoupled from rendering.
+
+    The sprite goes down every gravity seconds of wall clock time,
+    catching up at most max_catch_up steps after a stall. Keys are
+    applied as soon as they are read. The display is refreshed at most
+    fps times a second and only when something changed, so frames are
+    dropped rather than delayed when rendering is slow. A policy, if
+    given, picks a move after each step down, as in a demo.
+    """
+
+    def __init__(self, controller, display, keyboard, gravity=0.5, fps=30,
+            policy=None, max_catch_up=5):
+        self.controller = controller
+        self.display = display
+        self.keyboard = keyboard
+        self.gravity = gravity
+        self.frame_time = 1.0 / fps
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+
+    def _tick(self):
+        self.controller.down()
+        if self.policy is not None:
+            move = self.policy(self.controller)
+            if move is not None:
+                getattr(self.controller, move)()
+
+    def run(self):
+        """Play until the game is over (GameOver) or the player quits."""
+        now = time.time()
+        next_tick = now + self.gravity
+        next_frame = now
+        dirty = True
+        while True:
+            deadline = min(next_tick, next_frame) if dirty else next_tick
+            for action in self.keyboard.read(max(deadline - time.time(), 0)):
+                if action == 'quit':
+                    return
+                getattr(self.controller, action)()
+                dirty = True
+            now = time.time()
+            steps = 0
+            while now >= next_tick and steps < self.max_catch_up:
+                self._tick()
+                next_tick += self.gravity
+                steps += 1
+                dirty = True
+            if now >= next_tick:
+                # Too far behind: forget the missed steps.
+                next_tick = now + self.gravity
+            if dirty and now >= next_frame:
+                self.display.refresh()
+                dirty = False
+                next_frame = max(next_frame + self.frame_time, now)
+
+
+class Instruments(object):
+    """Count and time the calls of the game hot paths.
+
+    instrument() wraps the methods of a controller, its game area and a
+    display on the instances themselves, so that games not instrumented
+    run the plain methods at no cost. Times include nested calls: a step
+    down includes its collision checks.
+    """
+
+    probes = (
+        ('gamearea', 'check_collision', 'collision checks'),
+        ('gamearea', 'freeze_sprite', 'freezes'),
+        ('gamearea', 'clear_lines', 'line clears'),
+        ('controller', 'down', 'steps down'),
+        ('controller', 'rotate', 'rotations'),
+        ('controller', 'left', 'moves left'),
+        ('controller', 'right', 'moves right'),
+        ('display', 'refresh', 'renders'),
+    )
 
-    def _render_row(self, row):
-        render_bloc = lambda n: colored('#', color_names[n % len(color_names)])
-        line = ' '.join([render_bloc(cell) if cell else ' ' for cell in row])
-        return line
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.times = collections.Counter()
 
-    def _render_sprite(self, sprite):
-        yield ''
-        for row in sprite.matrix:
-            line = self._render_row(row)
-            yield line
+    def _wrap(self, obj, method, name):
+        function = getattr(obj, method)
+        counts, times, clock = self.counts, self.times, time.time
 
-    def _render_gamearea(self):
-        matrix = self.gamearea.matrix.copy()
-        merge_matrices(matrix, self.controller.sprite.matrix, self.controller.position)
-        for row in matrix:
-            line = '| %s |' % self._render_row(row)
-            yield line
+        def probe(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                times[name] += clock() - start
+                counts[name] += 1
 
-    def refresh(self):
-        os.system('clear')
-        next_sprite_renderer = self._render_sprite(self.controller.next_sprite)
-        gamearea_renderer = self._render_gamearea()
-        for lines in itertools.izip_longest(gamearea_renderer, next_sprite_renderer, fillvalue=''):
-            line = (' ' * 4).join(lines)
-            print line
+        setattr(obj, method, probe)
 
+    def instrument(self, controller, display=None):
+        objects = {'controller': controller, 'gamearea': controller.gamearea, 'display': display}
+        for attribute, method, name in self.probes:
+            if objects[attribute] is not None:
+                self._wrap(objects[attribute], method, name)
 
-import time
+    def summary(self, file=sys.stderr):
+        """Print calls per step down and time per call of each probe."""
+        steps = self.counts['steps down'] or 1
+        file.write('%-18s %10s %10s %10s %10s\n' % ('', 'calls', 'per step', 'total ms', 'mean us'))
+        for _, _, name in self.probes:
+            count = self.counts[name]
+            if count:
+                file.write('%-18s %10d %10.2f %10.1f %10.1f\n' % (name, count, float(count) / steps,
+                    self.times[name] * 1e3, self.times[name] * 1e6 / count))
+
+
+def random_move(controller):
+    return random.choice(['left', 'right', 'rotate'])
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-e', '--engine', choices=sorted(game_areas), default='numpy',
+        help='Game area implementation (default: %(default)s).')
+    parser.add_argument('-g', '--gravity', type=float, default=0.5,
+        help='Seconds between steps down (default: %(default)s).')
+    parser.add_argument('--fps', type=float, default=30,
+        help='Maximum refresh rate (default: %(default)s).')
+    parser.add_argument('--demo', action='store_true',
+        help='Play random moves, one after each step down.')
+    parser.add_argument('-s', '--seed', type=int,
+        help='Random seed, to play the same game again.')
+    parser.add_argument('--profile', action='store_true',
+        help='Count and time the hot paths, report them at game end.')
+    args = parser.parse_args()
+
     #logging.basicConfig(level=logging.DEBUG)
-    gamearea = GameArea()
-    controller = Controller(gamearea)
+    gamearea = game_areas[args.engine]()
+    # Sprites are drawn apart from the demo moves: the same seed gives the
+    # same sprites whoever plays.
+    random.seed(args.seed)
+    controller = Controller(gamearea, random.Random(args.seed))
     display = Display(gamearea, controller)
+    instruments = None
+    if args.profile:
+        instruments = Instruments()
+        instruments.instrument(controller, display)
 
     controller.start()
-    display.refresh()
-    while True:
-        try:
-            controller.down()
-            random.choice([
-                controller.left,
-                controller.right,
-                controller.rotate,
-            ])()
-        except GameOver:
-            break
+    try:
+        with Keyboard() as keyboard:
+            loop = GameLoop(controller, display, keyboard, args.gravity, args.fps,
+                policy=random_move if args.demo else None)
+            try:
+                loop.run()
+            except GameOver:
+                pass
         display.refresh()
-        time.sleep(0.05)
-    display.refresh()
+    finally:
+        display.close()
+        if instruments is not None:
+            instruments.summary()
 
 
 if __name__ == '__main__':
@@ -341,4 +763,3 @@ if __name__ == '__main__':
         main()
     except KeyboardInterrupt:
         pass
-
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""Compare TerminalTetris game settings over many seeded headless games.
+
+Each entry of the tournament is a game area shape, a sprite distribution
+and a policy; every entry plays the same seeds. Games are played in
+batches over a pool of processes, and their results are aggregated as
+they come into the mean and 95% confidence interval of the sprites
+placed, lines cleared and steps survived by each entry. Progress is
+checkpointed to a JSON file, from which an interrupted run resumes.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import simulator
+import tetris
+
+
+METRICS = ('sprites', 'lines', 'steps')
+
+
+class RunningStats(object):
+    """Count, mean and variance of a stream of values (Welford's method)."""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def interval(self, z=1.96):
+        """Half width of the confidence interval of the mean, 95% by default."""
+        return z * self.stddev / math.sqrt(self.count) if self.count else float('inf')
+
+    def to_json(self):
+        return [self.count, self.mean, self.m2]
+
+
+def parse_shape(text):
+    height, _, width = text.partition('x')
+    return int(height), int(width)
+
+
+def parse_weights(text):
+    weights = [int(weight) for weight in text.split(',')]
+    if len(weights) != len(tetris.sprite_types) or min(weights) < 0 or not any(weights):
+        raise argparse.ArgumentTypeError('expected %d weights, for %s' % (
+            len(tetris.sprite_types), ', '.join(t.__name__ for t in tetris.sprite_types)))
+    return tuple(weights)
+
+
+def entry_name(entry):
+    shape, weights, policy = entry
+    return '%dx%d %s %s' % (shape[0], shape[1], ','.join(map(str, weights)), policy)
+
+
+def play_batch(job):
+    """Play the games of a job, return (job id, entry index, results)."""
+    job_id, index, entry, seeds, max_steps = job
+    shape, weights, policy = entry
+    types = [t for t, weight in zip(tetris.sprite_types, weights) for _ in range(weight)]
+    if policy == 'ai':
+        import ai
+        policy = ai.Autoplayer()
+    else:
+        policy = simulator.random_policy
+    sim = simulator.Simulator(policy, max_steps=max_steps, shape=shape, types=types)
+    results = []
+    for seed in seeds:
+        random.seed(seed)
+        results.append(tuple(sim.play()))
+    return job_id, index, results
+
+
+class Tournament(object):
+    """Games to play, the stats of those played, and their checkpoint."""
+
+    def __init__(self, entries, games, seed=0, batch=50, max_steps=None):
+        self.entries = entries
+        self.config = {
+            'entries': [entry_name(entry) for entry in entries],
+            'games': games,
+            'seed': seed,
+            'batch': batch,
+            'max_steps': max_steps,
+        }
+        self.jobs = []
+        for index, entry in enumerate(entries):
+            for first in range(0, games, batch):
+                seeds = range(seed + first, seed + min(first + batch, games))
+                self.jobs.append((len(self.jobs), index, entry, seeds, max_steps))
+        self.done = set()
+        self.stats = [dict((metric, RunningStats()) for metric in METRICS) for _ in entries]
+
+    def add(self, job_id, index, results):
+        self.done.add(job_id)
+        for result in results:
+            for metric, value in zip(METRICS, result):
+                self.stats[index][metric].add(value)
+
+    def pending(self):
+        return [job for job in self.jobs if job[0] not in self.done]
+
+    def save(self, path):
+        state = {
+            'config': self.config,
+            'done': sorted(self.done),
+            'stats': [dict((metric, stats[metric].to_json()) for metric in METRICS)
+                for stats in self.stats],
+        }
+        # Written aside then renamed: a crash never leaves half a checkpoint.
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.rename(path + '.tmp', path)
+
+    def load(self, path):
+        with open(path) as f:
+            state = json.load(f)
+        if state['config'] != self.config:
+            raise ValueError('%s is the checkpoint of another tournament' % path)
+        self.done = set(state['done'])
+        self.stats = [dict((metric, RunningStats(*stats[metric])) for metric in METRICS)
+            for stats in state['stats']]
+
+    def report(self, file=sys.stdout):
+        file.write('%-32s %7s %18s %18s %18s\n' % (('entry', 'games') + METRICS))
+        for entry, stats in zip(self.entries, self.stats):
+            file.write('%-32s %7d %s\n' % (entry_name(entry), stats['sprites'].count, ' '.join(
+                '%18s' % ('%.2f +- %.2f' % (stats[metric].mean, stats[metric].interval()))
+                for metric in METRICS)))
+
+
+def run(tournament, jobs, checkpoint=None, every=10.0):
+    """Play the pending games of a tournament, checkpointing as it goes."""
+    pending = tournament.pending()
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    results = pool.imap_unordered(play_batch, pending) if pool else itertools.imap(play_batch, pending)
+    last = time.time()
+    try:
+        for result in results:
+            tournament.add(*result)
+            if checkpoint and time.time() - last >= every:
+                tournament.save(checkpoint)
+                last = time.time()
+                sys.stderr.write('%d/%d batches\n' % (len(tournament.done), len(tournament.jobs)))
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+            pool = None
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if checkpoint:
+            tournament.save(checkpoint)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--games', type=int, default=1000, help='Games per entry.')
+    parser.add_argument('--shape', type=parse_shape, action='append', metavar='HEIGHTxWIDTH',
+        help='Game area shape of an entry; repeat to compare (default: %dx%d).' % tetris.GameArea.shape)
+    parser.add_argument('--weights', type=parse_weights, action='append', metavar='I,O,T,L,J,Z,S',
+        help='Relative frequency of each sprite type; repeat to compare (default: uniform).')
+    parser.add_argument('-p', '--policy', choices=['random', 'ai'], action='append',
+        help='Policy of an entry; repeat to compare (default: random).')
+    parser.add_argument('-m', '--max-steps', type=int, help='Stop each game after this many steps.')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Seed of the first game.')
+    parser.add_argument('-b', '--batch', type=int, default=50,
+        help='Games per job sent to a process (default: %(default)s).')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+        help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument('-c', '--checkpoint', help='JSON file to save progress to, and resume from.')
+    parser.add_argument('--every', type=float, default=10.0,
+        help='Seconds between checkpoints (default: %(default)s).')
+    args = parser.parse_args()
+
+    shapes = args.shape or [tuple(tetris.GameArea.shape)]
+    policies = args.policy or ['random']
+    if 'ai' in policies and shapes != [tuple(tetris.GameArea.shape)]:
+        parser.error('the ai policy only plays the default shape')
+    entries = list(itertools.product(shapes, args.weights or [(1,) * len(tetris.sprite_types)], policies))
+    tournament = Tournament(entries, args.games, args.seed, args.batch, args.max_steps)
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        try:
+            tournament.load(args.checkpoint)
+        except ValueError as e:
+            parser.error(str(e))
+        sys.stderr.write('resuming: %d/%d batches done\n' % (len(tournament.done), len(tournament.jobs)))
+
+    start = time.time()
+    try:
+        run(tournament, args.jobs, args.checkpoint, args.every)
+    except KeyboardInterrupt:
+        sys.stderr.write('interrupted: %d/%d batches done\n' % (len(tournament.done), len(tournament.jobs)))
+        tournament.report()
+        sys.exit(1)
+    sys.stderr.write('%.2fs\n' % (time.time() - start))
+    tournament.report()
+
+
+if __name__ == '__main__':
+    main()